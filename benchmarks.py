@@ -0,0 +1,178 @@
+"""
+Rough benchmarks for the slow parts of edit_photo_exif.py, run against the
+export in facebook_data/.
+
+Usage: python benchmarks.py [name ...]
+
+With no arguments, every benchmark is run.
+"""
+import os
+import sys
+import time
+from array import array
+from typing import Callable
+
+import edit_photo_exif as epe
+
+
+def time_it(function: Callable[[], object], repeat: int = 3) -> float:
+    """
+    Runs `function` `repeat` times and returns the best time, in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def bench_json_backends() -> None:
+    """
+    Throughput of each installed JSON backend on the message, album and posts
+    files.
+    """
+    message_files = [
+        path
+        for directory in epe.get_all_message_dirs()
+        for path in epe.list_conversation_files(directory)
+    ]
+    album_files = [
+        os.path.join(epe.ALBUM_DIR, f)
+        for f in epe.list_export_dir(epe.ALBUM_DIR)
+        if f.endswith(".json")
+    ]
+    file_sets = {
+        "messages": message_files,
+        "albums": album_files,
+        "posts": [epe.POSTS_AND_CHECKINS, epe.UNCATEGORIZED_PHOTOS],
+    }
+
+    for set_name, paths in file_sets.items():
+        # Read everything up front so we're timing parsing, not the disk.
+        contents = []
+        for path in paths:
+            with epe.open_export_file(path) as file:
+                contents.append(file.read())
+        size_mb = sum(len(c) for c in contents) / 1e6
+
+        for backend_name, loads in epe.JSON_BACKENDS.items():
+            elapsed = time_it(lambda: [loads(c) for c in contents])
+            print(
+                f"{set_name:>10} {backend_name:>10}: "
+                f"{size_mb / elapsed:8.1f} MB/s ({size_mb:.1f} MB)"
+            )
+
+
+def _chained_get_taken_timestamp(structure: dict) -> int | None:
+    """
+    The original implementation of `get_taken_timestamp()`, for comparison.
+    """
+    return (
+        structure.get("media_metadata", {})
+        .get("photo_metadata", {})
+        .get("exif_data", [{}])[0]
+        .get("taken_timestamp")
+    )
+
+
+def bench_taken_timestamp() -> None:
+    """
+    `get_taken_timestamp()` against the old chained `.get()` lookups, on photo
+    structures with and without EXIF data.
+    """
+    structures = {
+        "no metadata": {"uri": "a.jpg", "creation_timestamp": 1},
+        "with exif": {
+            "uri": "a.jpg",
+            "creation_timestamp": 1,
+            "media_metadata": {
+                "photo_metadata": {"exif_data": [{"taken_timestamp": 2}]}
+            },
+        },
+    }
+    count = 1_000_000
+
+    for label, structure in structures.items():
+        for name, function in (
+            ("chained .get", _chained_get_taken_timestamp),
+            ("get_taken_timestamp", epe.get_taken_timestamp),
+        ):
+            elapsed = time_it(lambda: [function(structure) for _ in range(count)])
+            print(f"{label:>12} {name:>20}: {elapsed / count * 1e9:6.1f} ns/call")
+
+
+def bench_exif_dates() -> None:
+    """
+    `format_exif_dates()` against formatting each timestamp with
+    `exif_date_bytes()`.
+    """
+    count = 1_000_000
+    timestamps = array("q", range(1_500_000_000, 1_500_000_000 + count * 97, 97))
+
+    for name, function in (
+        ("exif_date_bytes", lambda: [epe.exif_date_bytes(t) for t in timestamps]),
+        ("format_exif_dates", lambda: epe.format_exif_dates(timestamps)),
+    ):
+        elapsed = time_it(function)
+        print(f"{name:>20}: {elapsed / count * 1e9:6.1f} ns/date")
+    if epe.numpy is None:
+        print("(NumPy isn't installed, so format_exif_dates() formats one at a time)")
+
+
+def _drop_from_page_cache(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def bench_write_order() -> None:
+    """
+    Reading the first block of every photo, which is where the edits go, in
+    the order they're found against the order `schedule_edits()` picks. The
+    photos are dropped from the page cache first, so this measures the disk,
+    and only means something on the drive the export is on.
+    """
+    photos, _ = epe.deduplicate_photos(epe.collect_photos())
+    elapsed = time_it(lambda: epe.schedule_edits(photos), repeat=1)
+    print(f"{'schedule_edits':>16}: {elapsed:6.2f} s for {len(photos)} photos")
+
+    orders = {"found": photos, "disk": epe.schedule_edits(photos)}
+    for name, order in orders.items():
+        paths = [epe.URI_ROOT + photo.uri for photo in order]
+        _drop_from_page_cache(paths)
+        start = time.perf_counter()
+        for path in paths:
+            try:
+                with open(path, "rb") as file:
+                    file.read(4096)
+            except OSError:
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"{name:>16}: {elapsed:6.2f} s ({len(paths) / elapsed:.0f} photos/s)")
+
+
+BENCHMARKS: dict[str, Callable[[], None]] = {
+    "json_backends": bench_json_backends,
+    "taken_timestamp": bench_taken_timestamp,
+    "exif_dates": bench_exif_dates,
+    "write_order": bench_write_order,
+}
+
+
+def main(argv: list[str]) -> None:
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
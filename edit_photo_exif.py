@@ -5,14 +5,71 @@ photos onto google images, it'll be in the wrong place in the timeline.
 Solution: match each photo with when it was posted, and then edit the EXIF data
 to match.
 """
+import argparse
+import contextlib
+import hashlib
+import itertools
 import os
+import re
+import sys
 import json
-from dataclasses import dataclass
-from typing import Any
+import mmap
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+import zlib
+import zoneinfo
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Iterable, Iterator, NamedTuple
 import piexif
 import datetime
 from datetime import datetime as DateTime
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 URI_ROOT = "facebook_data/"
 POSTS_DIR = "facebook_data/your_activity_across_facebook/posts"
 ALBUM_DIR = POSTS_DIR + "/album"
@@ -20,15 +77,155 @@ POSTS_AND_CHECKINS = "facebook_data/your_activity_across_facebook/posts/your_pos
 UNCATEGORIZED_PHOTOS = (
     "facebook_data/your_activity_across_facebook/posts/your_uncategorized_photos.json"
 )
+YOUR_VIDEOS = "facebook_data/your_activity_across_facebook/posts/your_videos.json"
 MESSAGES_DIR = "facebook_data/your_activity_across_facebook/messages"
 INBOX_DIR = MESSAGES_DIR + "/inbox"
 ARCHIVED_DIR = MESSAGES_DIR + "/archived_threads"
+MESSAGE_REQUESTS_DIR = MESSAGES_DIR + "/message_requests"
+FILTERED_DIR = MESSAGES_DIR + "/filtered_threads"
+E2EE_CUTOVER_DIR = MESSAGES_DIR + "/e2ee_cutover"
+MESSAGE_ROOTS = [
+    INBOX_DIR,
+    ARCHIVED_DIR,
+    MESSAGE_REQUESTS_DIR,
+    FILTERED_DIR,
+    E2EE_CUTOVER_DIR,
+]
+
+# How many directories to list at once when looking for conversations. Listing
+# is mostly waiting on the disk (or the network, for NFS), so this can be high.
+DISCOVERY_THREADS = 16
+
+# The JSON parsers we know how to use, fastest first. Each one takes the raw
+# bytes of a file and returns the parsed document.
+JSON_BACKENDS: dict[str, Callable[[bytes], Any]] = {}
+if orjson is not None:
+    JSON_BACKENDS["orjson"] = orjson.loads
+if simdjson is not None:
+    JSON_BACKENDS["simdjson"] = simdjson.loads
+if msgspec is not None:
+    JSON_BACKENDS["msgspec"] = msgspec.json.decode
+JSON_BACKENDS["json"] = json.loads
+
+json_backend = next(iter(JSON_BACKENDS))
+
+# The bits of the JPEG and EXIF formats we need to edit the metadata of photos.
+# The year is formatted separately (see `format_exif_date()`).
+EXIF_DATE_FORMAT = ":%m:%d %H:%M:%S"
+EXIF_DATE_LENGTH = 20
+# EXIF dates have four digit years, so these are the first and last seconds
+# (0001-01-01 and 9999-12-31) that can be written as one.
+MIN_EXIF_TIMESTAMP = -62135596800
+MAX_EXIF_TIMESTAMP = 253402300799
+# The OffsetTimeOriginal of a date in UTC.
+UTC_OFFSET = "+00:00"
+EXIF_HEADER = b"Exif\0\0"
+JPEG_SOI = b"\xff\xd8"
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# The major brands in the ftyp box of ISO media files that we know the format
+# of. Other files with an ftyp box, like AVIF images, aren't videos we can
+# edit.
+HEIC_BRANDS = (b"heic", b"heix", b"mif1", b"msf1")
+MP4_BRANDS = (
+    b"isom",
+    b"iso2",
+    b"iso4",
+    b"iso5",
+    b"iso6",
+    b"mp41",
+    b"mp42",
+    b"avc1",
+    b"M4V ",
+    b"M4VP",
+    b"MSNV",
+    b"dash",
+    b"f4v ",
+    b"mmp4",
+)
+PNG_XMP_KEYWORD = b"XML:com.adobe.xmp"
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# MP4 and MOV times are seconds since the start of 1904, UTC.
+MP4_EPOCH = DateTime(1904, 1, 1, tzinfo=datetime.UTC)
+MP4_CONTAINER_BOXES = (b"moov", b"trak", b"mdia")
+MP4_TIME_BOXES = (b"mvhd", b"tkhd", b"mdhd")
+TIFF_ASCII = 2
+# The size in bytes of each TIFF value type.
+TIFF_TYPE_SIZES = {
+    1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8
+}
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+DATE_TIME = 0x0132
+IMAGE_DESCRIPTION = 0x010E
+DATE_TIME_ORIGINAL = 0x9003
+DATE_TIME_DIGITIZED = 0x9004
+OFFSET_TIME_ORIGINAL = 0x9011
+GPS_VERSION_ID = 0x0000
+GPS_LATITUDE_REF = 0x0001
+GPS_LATITUDE = 0x0002
+GPS_LONGITUDE_REF = 0x0003
+GPS_LONGITUDE = 0x0004
+
+# How many bytes `sniff_media_type()` needs to tell formats apart.
+SNIFF_SIZE = 16
+
+# The format of each file `sniff_media_type()` has looked at.
+media_types: dict[str, str | None] = {}
+
+# Set by `use_zip_export()` when reading the export straight out of its zip
+# files rather than from `URI_ROOT`.
+export_archive: "ZipExport | None" = None
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+
+# Set by `use_output_dir()`.
+output_dir: str | None = None
+# The Linux ioctl that makes a reflink copy of a file.
+FICLONE = 0x40049409
+
+# Set by `use_photo_cache()`.
+photo_cache: "PhotoCache | None" = None
+CACHE_PATH = URI_ROOT + ".photo_cache.sqlite"
+JOURNAL_PATH = URI_ROOT + ".run_journal.sqlite"
+PLAN_PATH = "edit_plan.jsonl"
+CONTENT_INDEX_PATH = URI_ROOT + ".content_index.sqlite"
+
+# How much of the start and end of each file to hash when looking for
+# duplicates, and how many files to hash between commits.
+PARTIAL_HASH_SIZE = 64 * 1024
+HASH_BATCH_SIZE = 1000
+
+# How many photos to hand to a worker process at once when using --workers.
+EDIT_CHUNK_SIZE = 64
+
+# The Linux ioctl that says where a file's data is on disk, and the sizes of
+# the header and of one extent in what it fills in (see linux/fiemap.h).
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER_SIZE = 32
+FIEMAP_EXTENT_SIZE = 56
+
+# Directory listings of each conversation, filled in by `get_all_message_dirs()`.
+conversation_listings: dict[str, list[str]] = {}
+
+# Set by `use_time_zones()`. None writes every date in UTC.
+time_zones: "TimeZones | None" = None
+# How far apart `ZoneOffsets` checks the UTC offset of a zone. Zones don't
+# change their offset twice in one day.
+ZONE_PROBE_INTERVAL = 24 * 60 * 60
 
 
 @dataclass
 class Photo:
     uri: str
     timestamp: int
+    # Whether `timestamp` is when the photo was taken, rather than uploaded.
+    taken: bool = False
+    # Where in the export we found it: "messages", "album", "uncategorized",
+    # "posts" or "videos".
+    source: str = ""
 
     @classmethod
     def from_json_structure(cls, structure: dict):
@@ -48,59 +245,273 @@ class Photo:
         of the creation_timestamp.
         """
         uri = structure["uri"]
-        timestamp = (
-            structure.get("media_metadata", {})
-            .get("photo_metadata", {})
-            .get("exif_data", [{}])[0]
-            .get("taken_timestamp")
+        timestamp = get_taken_timestamp(structure)
+        if timestamp is None:
+            return cls(uri, structure["creation_timestamp"])
+
+        return cls(uri, timestamp, taken=True)
+
+
+def get_taken_timestamp(structure: dict) -> int | None:
+    """
+    Returns "media_metadata" -> "photo_metadata" -> "exif_data"[0] ->
+    "taken_timestamp" from a photo's JSON structure, or None if any part of
+    that is missing (including an empty "exif_data" list).
+
+    This runs once per photo, so unlike a chain of `.get(key, {})` calls, it
+    doesn't build any throwaway default dicts or lists along the way.
+    """
+    media_metadata = structure.get("media_metadata")
+    if media_metadata is None:
+        return None
+    photo_metadata = media_metadata.get("photo_metadata")
+    if photo_metadata is None:
+        return None
+    exif_data = photo_metadata.get("exif_data")
+    if not exif_data:
+        return None
+    return exif_data[0].get("taken_timestamp")
+
+
+class PhotoRow(NamedTuple):
+    """
+    One row of a `PhotoTable`. It has the same fields as `Photo`, so code that
+    only reads photos can take either, but it's a plain tuple, which is much
+    cheaper to make.
+    """
+
+    uri: str
+    timestamp: int
+    taken: bool
+    source: str
+
+
+class PhotoTable:
+    """
+    A list of photos, stored a column at a time in flat arrays rather than as
+    one `Photo` object per photo. A big export has millions of photos, and
+    a `Photo` plus its URI string costs a couple of hundred bytes, most of it
+    object headers and the same directory names over and over. Here, each
+    directory is stored once, and a photo is its file name plus a few bytes
+    of numbers.
+
+    Rows are read back as `PhotoRow`s, which are made as they are needed and
+    not kept.
+    """
+
+    def __init__(self, photos: Iterable[Photo | PhotoRow] = ()):
+        # Every directory a photo is in, and the index of each in that list.
+        self.directories: list[str] = []
+        self._directory_ids: dict[str, int] = {}
+        # Every source, as for directories. There are only a handful.
+        self.sources: list[str] = []
+        self._source_ids: dict[str, int] = {}
+
+        # The columns. The file names are stored back to back in `names`,
+        # with the end of each one in `name_ends`.
+        self.directory_ids = array("L")
+        self.names = bytearray()
+        self.name_ends = array("Q")
+        self.timestamps = array("q")
+        self.taken = bytearray()
+        self.source_ids = bytearray()
+
+        self.extend(photos)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, index: int) -> PhotoRow:
+        index = self._check_index(index)
+        return PhotoRow(
+            self.uri(index),
+            self.timestamps[index],
+            bool(self.taken[index]),
+            self.sources[self.source_ids[index]],
         )
+
+    def __iter__(self) -> Iterator[PhotoRow]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def uri(self, index: int) -> str:
+        index = self._check_index(index)
+        start = self.name_ends[index - 1] if index > 0 else 0
+        name = self.names[start : self.name_ends[index]].decode()
+        directory = self.directories[self.directory_ids[index]]
+        return f"{directory}/{name}" if directory else name
+
+    def add(
+        self, uri: str, timestamp: int, taken: bool = False, source: str = ""
+    ) -> None:
+        """
+        Adds a photo to the end of the table.
+        """
+        directory, _, name = uri.rpartition("/")
+        self.directory_ids.append(self._directory_id(directory))
+        self.names += name.encode()
+        self.name_ends.append(len(self.names))
+        self.timestamps.append(timestamp)
+        self.taken.append(taken)
+        self.source_ids.append(self._source_id(source))
+
+    def add_json_structure(self, structure: dict, source: str = "") -> None:
+        """
+        Adds the photo described by `structure` (see
+        `Photo.from_json_structure()`) without making a `Photo` for it.
+        """
+        timestamp = get_taken_timestamp(structure)
         if timestamp is None:
-            timestamp = structure["creation_timestamp"]
+            self.add(structure["uri"], structure["creation_timestamp"], False, source)
+        else:
+            self.add(structure["uri"], timestamp, True, source)
+
+    def append(self, photo: Photo | PhotoRow) -> None:
+        self.add(photo.uri, photo.timestamp, photo.taken, photo.source)
+
+    def extend(
+        self,
+        photos: "Iterable[Photo | PhotoRow] | PhotoTable",
+        source: str | None = None,
+    ) -> None:
+        """
+        Adds `photos` to the end of the table. If `source` is given, it
+        replaces the source of every one of them.
+
+        Another table is copied a column at a time, without going through its
+        rows.
+        """
+        if isinstance(photos, PhotoTable):
+            self._extend_table(photos, source)
+            return
+
+        for photo in photos:
+            self.add(
+                photo.uri,
+                photo.timestamp,
+                photo.taken,
+                photo.source if source is None else source,
+            )
+
+    def set_date(self, index: int, timestamp: int, taken: bool) -> None:
+        self.timestamps[index] = timestamp
+        self.taken[index] = taken
+
+    def replace(self, index: int, photo: Photo | PhotoRow) -> None:
+        """
+        Replaces the date and source of the photo at `index` with those of
+        `photo`, which must have the same URI.
+        """
+        self.set_date(index, photo.timestamp, photo.taken)
+        self.source_ids[index] = self._source_id(photo.source)
+
+    def _check_index(self, index: int) -> int:
+        # The start of a name is the end of the one before it, so a negative
+        # index has to be turned into the real one first.
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PhotoTable index out of range")
+        return index
+
+    def _extend_table(self, other: "PhotoTable", source: str | None) -> None:
+        # The tables number their directories and sources differently.
+        directory_ids = [self._directory_id(d) for d in other.directories]
+        self.directory_ids.extend(directory_ids[i] for i in other.directory_ids)
+        name_offset = len(self.names)
+        self.names += other.names
+        self.name_ends.extend(end + name_offset for end in other.name_ends)
+        self.timestamps.extend(other.timestamps)
+        self.taken += other.taken
+        if source is None:
+            source_ids = [self._source_id(s) for s in other.sources]
+            self.source_ids.extend(source_ids[i] for i in other.source_ids)
+        else:
+            self.source_ids += bytes([self._source_id(source)]) * len(other)
 
-        return cls(uri, timestamp)
+    def _directory_id(self, directory: str) -> int:
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self._directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        return directory_id
 
+    def _source_id(self, source: str) -> int:
+        source_id = self._source_ids.get(source)
+        if source_id is None:
+            source_id = self._source_ids[source] = len(self.sources)
+            self.sources.append(source)
+        return source_id
 
-def get_photos_from_album(album_dir: str) -> list[Photo]:
+
+def get_photos_from_album(
+    album_dir: str, into: PhotoTable | None = None, source: str = ""
+) -> PhotoTable:
     """
     In album_dir, there are multiple JSON files, named like 0.jons, 1.json, etc.
     Each JSON file represents one album. The file contains some album metadata,
     like the name and cover photo, but all we're interested in is the "photos"
     key, which is a list of all photos.
+
+    The photos are added to `into` (or a new table), with `source` as their
+    source, and the table is returned.
     """
     # Initialize a list to keep track of all json files in the directory
-    json_files = [f for f in os.listdir(album_dir) if f.endswith(".json")]
+    json_files = [f for f in list_export_dir(album_dir) if f.endswith(".json")]
 
-    # Initialize an empty dict for the merged data
-    photos: list[Photo] = []
+    photos = PhotoTable() if into is None else into
 
     for file_name in json_files:
         file_path = os.path.join(album_dir, file_name)
-        with open(file_path, "r") as file:
-            data = json.load(file)
-
-        extracted = extract_photos_from_list(data["photos"])
-        photos.extend(extracted)
+        extracted = cached_photos(file_path, get_photos_from_album_file)
+        photos.extend(extracted, source=source)
 
     return photos
 
 
-def extract_photos_from_list(photos_data: list[dict]) -> list[Photo]:
+def get_photos_from_album_file(file_path: str) -> PhotoTable:
+    data = read_json(file_path)
+    return extract_photos_from_list(data["photos"])
+
+
+def get_uncategorized_photos(file_path: str) -> PhotoTable:
+    """
+    The uncategorized photos are in the same format as the albums, but under
+    the "other_photos_v2" key.
+    """
+    data = read_json(file_path)
+    return extract_photos_from_list(data["other_photos_v2"])
+
+
+def get_photos_from_posts_file(file_path: str) -> PhotoTable:
+    return extract_photos_from_posts(read_json(file_path))
+
+
+def get_your_videos(file_path: str) -> PhotoTable:
+    """
+    The videos you uploaded are in the same format as the albums, but under the
+    "videos_v2" key.
+    """
+    data = read_json(file_path)
+    return extract_photos_from_list(data["videos_v2"])
+
+
+def extract_photos_from_list(photos_data: list[dict]) -> PhotoTable:
     """
     `photos_data` is a list of dictionaries containing information about each
     photo. See documentation for `Photo.from_json_structure()`.
 
-    Returns a list of all photos.
+    Returns a table of all photos.
     """
-    photos: list[Photo] = []
+    photos = PhotoTable()
 
     for photo in photos_data:
-        p = Photo.from_json_structure(photo)
-        photos.append(p)
+        photos.add_json_structure(photo)
 
     return photos
 
 
-def extract_photos_from_posts(data: list[dict]) -> list[Photo]:
+def extract_photos_from_posts(data: list[dict]) -> PhotoTable:
     """
     This file is a bit different than the others. Each item in the `data` list
     corresponds to a single post. A single post can have multiple image
@@ -109,143 +520,2571 @@ def extract_photos_from_posts(data: list[dict]) -> list[Photo]:
     information in the same dictionary structure as used for albums and
     uncategorized photos.
 
-    Returns a list of photos.
+    Returns a table of photos.
     """
-    photos: list[Photo] = []
+    photos = PhotoTable()
 
     for photo in data:
         data_section: list[dict] = photo.get("attachments", [{}])[0].get("data", [{}])
         for entry in data_section:
             if "media" in entry:
-                p = Photo.from_json_structure(entry["media"])
-                photos.append(p)
+                photos.add_json_structure(entry["media"])
 
     return photos
 
 
-def merge_conversation(directory: str) -> dict:
+def list_conversation_files(directory: str) -> list[str]:
     """
     In `directory`, there are multiple JSON files, named like message_1.json,
     message_2.json, etc. They're split up for performance reasons, I assume.
 
-    This function merges them and returns the resulting dictionary.
+    Returns the full paths of those files, in order.
     """
-    # Initialize a list to keep track of all json files in the directory
-    json_files = [f for f in os.listdir(directory) if f.endswith(".json")]
-    # FIXME: If the numbers exceed two digits, then the sorting will be wrong.
-    #        Need to use something like natsort.
-    #        https://pypi.org/project/natsort/
-    json_files.sort()
-
-    # Initialize an empty dict for the merged data
-    merged_data = {}
-
-    for index, file_name in enumerate(json_files):
-        file_path = os.path.join(directory, file_name)
-        with open(file_path, "r") as file:
-            data = json.load(file)
-
-            if index == 0:
-                # For the first file, save all its contents
-                merged_data = data
-            else:
-                # For subsequent files, only append the 'messages' list
-                merged_data["messages"].extend(data["messages"])
+    names = conversation_listings.get(directory)
+    if names is None:
+        names = list_export_dir(directory)
+    json_files = [f for f in names if f.endswith(".json")]
+    # Sort by page number, so message_10.json comes after message_2.json.
+    json_files.sort(key=lambda f: (conversation_page_number(f), f))
+
+    return [os.path.join(directory, f) for f in json_files]
+
+
+def conversation_page_number(file_name: str) -> int:
+    """
+    Returns N for a file named message_N.json. Anything else sorts last.
+    """
+    match = PAGE_NUMBER_PATTERN.fullmatch(os.path.basename(file_name))
+    if match is None:
+        return sys.maxsize
+    return int(match.group(1))
+
+
+def iter_page_messages(file_path: str) -> Iterator[dict]:
+    """
+    Yields every message in a single message_N.json file, one at a time with
+    ijson if it's installed, or by loading the whole page if not.
+    """
+    if ijson is None:
+        # Like ijson, a page without messages just has no photos.
+        yield from read_json(file_path).get("messages", [])
+        return
 
-    return merged_data
+    with open_export_file(file_path) as file:
+        yield from ijson.items(file, "messages.item", use_float=True)
 
 
-def extract_photos_from_messages(messages: list[dict]) -> list[Photo]:
+def extract_photos_from_messages(messages: Iterable[dict]) -> PhotoTable:
     """
-    This function accepts a list containing all of the messages from a
-    conversation. The dictionary entries are not uniform. Some of them have a
-    `photos` key, which contains a list of all photos attached to the message.
+    This function accepts an iterable of all of the messages from a
+    conversation page, such as the ones `iter_page_messages()` yields.
+    The dictionary entries are not uniform. Some of them have a `photos` key,
+    which contains a list of all photos attached to the message, and some have
+    a `videos` key, which is the same thing for videos.
 
-    This function returns a list of photos.
+    This function returns a table of photos (and videos, which use the same
+    structure).
     """
-    photos: list[Photo] = []
+    photos = PhotoTable()
     for message in messages:
-        if "photos" in message:
-            for photo in message["photos"]:
-                p = Photo.from_json_structure(photo)
-                photos.append(p)
+        for key in ("photos", "videos"):
+            if key in message:
+                for photo in message[key]:
+                    photos.add_json_structure(photo)
+
+    return photos
+
+
+# Matches the start of a "photos" or "videos" array in a message file. The JSON
+# in the export is ASCII-only (everything else is \u-escaped), so we can search
+# the raw bytes.
+PHOTOS_ARRAY_PATTERN = re.compile(rb'"(?:photos|videos)"\s*:\s*\[')
+SCAN_WINDOW_SIZE = 4096
+PAGE_NUMBER_PATTERN = re.compile(r"message_(\d+)\.json")
+
+# How much JSON to hand to a worker process at once when using --jobs.
+CHUNK_TARGET_BYTES = 16 * 1024 * 1024
+
+
+class UnexpectedLayout(Exception):
+    """
+    Raised by the byte scanner when a file doesn't look the way we expect, so
+    the caller can fall back to the full JSON parser.
+    """
+
+
+def _decode_array_at(buffer: bytes | mmap.mmap, start: int) -> list:
+    """
+    Decodes the JSON array starting at byte offset `start` in `buffer`.
+
+    Photo arrays are small, so rather than decoding everything to the end of the
+    file we decode a small window and double it until the array fits.
+    """
+    decoder = json.JSONDecoder()
+    window = SCAN_WINDOW_SIZE
+    while True:
+        end = min(start + window, len(buffer))
+        text = buffer[start:end].decode("utf-8", errors="ignore")
+        try:
+            value, _ = decoder.raw_decode(text)
+            return value
+        except json.JSONDecodeError:
+            if end == len(buffer):
+                raise UnexpectedLayout(f"unterminated photos array at {start}")
+            window *= 2
+
+
+def scan_photos_from_file(file_path: str) -> PhotoTable:
+    """
+    Fast path for pulling photos out of a message_N.json file.
+
+    Most messages don't have any photos, so instead of parsing the whole file,
+    we memory-map it, search for `"photos": [` (and `"videos": [`) and only
+    decode those arrays.
+    Raises `UnexpectedLayout` if the file doesn't look like a message file.
+    """
+    if export_archive is not None:
+        # Zip members can't be memory-mapped, but they're compressed anyway,
+        # so we have to read the whole thing regardless.
+        with open_export_file(file_path) as file:
+            return _scan_photos_from_buffer(file.read(), file_path)
+
+    with open(file_path, "rb") as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            raise UnexpectedLayout(f"{file_path} is empty")
+
+        with buffer:
+            return _scan_photos_from_buffer(buffer, file_path)
+
+
+def _scan_photos_from_buffer(
+    buffer: bytes | mmap.mmap, file_path: str
+) -> PhotoTable:
+    photos = PhotoTable()
+
+    if buffer.find(b'"messages"') == -1:
+        raise UnexpectedLayout(f"{file_path} has no messages")
+
+    for match in PHOTOS_ARRAY_PATTERN.finditer(buffer):
+        # A key can't start with an escaped quote, so if there's a backslash in
+        # front, it's inside a string value.
+        if match.start() > 0 and buffer[match.start() - 1] == ord("\\"):
+            continue
+        try:
+            photos_data = _decode_array_at(buffer, match.end() - 1)
+            photos.extend(extract_photos_from_list(photos_data))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise UnexpectedLayout(f"{file_path}: {e!r}")
+
+    return photos
+
+
+def extract_photos_from_conversation(directory: str) -> PhotoTable:
+    """
+    Returns all the photos in the conversation stored in `directory`.
+
+    Each page is handled by the byte scanner in `scan_photos_from_file()`, and
+    any page it can't make sense of is parsed in full instead.
+    """
+    photos = PhotoTable()
+    for file_path in list_conversation_files(directory):
+        photos.extend(cached_photos(file_path, extract_photos_from_page))
+
+    return photos
+
+
+def extract_photos_from_page(file_path: str) -> PhotoTable:
+    """
+    Returns all the photos in a single message_N.json file.
+    """
+    try:
+        return scan_photos_from_file(file_path)
+    except UnexpectedLayout:
+        return extract_photos_from_messages(iter_page_messages(file_path))
+
+
+def chunk_pages(pages: list[str], target_bytes: int) -> list[list[str]]:
+    """
+    Splits `pages`, the message_N.json files of one or more conversations, into
+    consecutive chunks holding roughly `target_bytes` of JSON each.
+
+    Lots of tiny conversations get sent to a worker together, while a huge
+    conversation is spread across several chunks so it can be parsed by several
+    workers at once. Either way, the pages stay in order.
+    """
+    chunks: list[list[str]] = []
+    chunk: list[str] = []
+    chunk_bytes = 0
+
+    for file_path in pages:
+        size = export_file_size(file_path)
+        if chunk and chunk_bytes + size > target_bytes:
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(file_path)
+        chunk_bytes += size
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def _extract_photo_records(pages: list[str]) -> list[list[tuple]]:
+    """
+    Worker for `extract_photos_from_conversations()`. Returns the photos of
+    each page as plain tuples of `PhotoRow` fields, since they're cheaper to
+    send back to the parent process than tables.
+    """
+    return [
+        [tuple(photo) for photo in extract_photos_from_page(page)]
+        for page in pages
+    ]
+
+
+def _init_worker(
+    backend: str, zip_paths: list[str], output_path: str | None = None
+) -> None:
+    """
+    Sets up a worker process with the same settings as the parent. Zip files
+    can't be sent between processes, so each worker opens its own.
+    """
+    set_json_backend(backend)
+    use_zip_export(zip_paths)
+    use_output_dir(output_path)
+
+
+def extract_photos_from_conversations(
+    directories: list[str],
+    jobs: int = 1,
+    into: PhotoTable | None = None,
+    source: str = "",
+) -> PhotoTable:
+    """
+    Adds the photos from all the conversations in `directories` to `into` (or
+    a new table), with `source` as their source, and returns the table.
+
+    If `jobs` is more than 1, the pages are parsed in that many worker
+    processes. Either way, the photos are added in the same order, and each
+    page is added as soon as it's ready.
+    """
+    photos = PhotoTable() if into is None else into
+    if jobs <= 1:
+        for directory in directories:
+            photos.extend(extract_photos_from_conversation(directory), source=source)
+        return photos
+
+    pages = [p for d in directories for p in list_conversation_files(d)]
+
+    # The workers don't touch the cache, so only send them the pages that
+    # aren't in it.
+    signatures: dict[str, tuple[int, int]] = {}
+    cached: set[str] = set()
+    if photo_cache is not None:
+        for page in pages:
+            signatures[page] = export_file_signature(page)
+            if photo_cache.has(page, signatures[page]):
+                cached.add(page)
+    uncached = [page for page in pages if page not in cached]
+
+    chunks = chunk_pages(uncached, CHUNK_TARGET_BYTES)
+    zip_paths = export_archive.zip_paths if export_archive is not None else []
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(json_backend, zip_paths),
+    ) as executor:
+        # `map` yields results in the order of `chunks`, no matter which
+        # worker finishes first, so they come in the order of `uncached`.
+        results = (
+            records
+            for chunk_records in executor.map(_extract_photo_records, chunks)
+            for records in chunk_records
+        )
+        for page in pages:
+            if page in cached:
+                page_photos = photo_cache.get(page, signatures[page])
+            else:
+                page_photos = PhotoTable(map(PhotoRow._make, next(results)))
+                if photo_cache is not None:
+                    photo_cache.put(page, signatures[page], page_photos)
+            photos.extend(page_photos, source=source)
 
     return photos
 
 
 def get_all_message_dirs() -> list[str]:
-    directories = []
-    for directory in (INBOX_DIR, ARCHIVED_DIR):
-        with os.scandir(directory) as iterator:
-            for entry in iterator:
-                if entry.is_dir():
-                    directories.append(entry.path)
+    """
+    Returns every conversation directory under `MESSAGE_ROOTS`. Roots that
+    don't exist in this export are skipped.
+
+    The roots, and then the conversations themselves, are listed concurrently.
+    The conversation listings are saved in `conversation_listings`, so
+    `list_conversation_files()` doesn't have to list them again.
+    """
+    with ThreadPoolExecutor(DISCOVERY_THREADS) as executor:
+        directories = []
+        for subdirs in executor.map(_list_message_root, MESSAGE_ROOTS):
+            # The listing order depends on the filesystem, so sort to make runs
+            # reproducible.
+            directories.extend(sorted(subdirs))
+
+        listings = executor.map(list_export_dir, directories)
+        conversation_listings.update(zip(directories, listings))
 
     return directories
 
 
-def modify_date_taken(photo_path: str, new_date: DateTime) -> None:
+def _list_message_root(directory: str) -> list[str]:
+    try:
+        return list_export_subdirs(directory)
+    except FileNotFoundError:
+        return []
+
+
+def modify_date_taken(photo_path: str, new_date: DateTime) -> bool:
     """
-    Modify the "date taken" field in the EXIF data of a photo.
+    Modify the "date taken" field in the metadata of a photo, using the writer
+    in `MEDIA_WRITERS` for its format.
 
-    Does nothing if the photo doesn't have a .jpg extension.
+    Does nothing if we don't know how to edit that format, or if it already has
+    the right date. Returns whether the photo was changed.
     """
+    writer = MEDIA_WRITERS.get(sniff_media_type(photo_path))
+    if writer is None:
+        return False
 
-    if not photo_path.endswith(".jpg"):
-        return
+    return writer(photo_path, ExifDate.from_datetime(new_date))
+
+
+class ExifDate(NamedTuple):
+    """
+    The date to give a photo, in the forms the writers need. Formatting dates
+    one at a time is slow with millions of photos, so `edit_photos()` formats
+    them all at once with `format_exif_dates()`, and the writers use the
+    results as they are.
+    """
+
+    # Seconds since the Unix epoch.
+    timestamp: int
+    # The date as it's stored in EXIF: "YYYY:MM:DD HH:MM:SS\0".
+    exif: bytes
+    # The UTC offset of `exif`, like "+01:00", if it's in a particular time
+    # zone (see `use_time_zones()`).
+    offset: str | None = None
+
+    @classmethod
+    def from_datetime(cls, date: DateTime) -> "ExifDate":
+        exif = format_exif_date(date).encode("ascii") + b"\0"
+        return cls(int(date.timestamp()), exif)
+
+
+def modify_jpeg_date_taken(photo_path: str, new_date: ExifDate) -> bool:
+    return apply_metadata_edit(photo_path, date_taken_edit(new_date))
+
+
+def date_taken_edit(new_date: ExifDate) -> "MetadataEdit":
+    """
+    The edit that sets the date taken of a photo to `new_date`. If the date is
+    in UTC, a photo that already has an OffsetTimeOriginal (from another time
+    zone, say) has it set to UTC too, but one isn't added if it doesn't.
+    """
+    edit = MetadataEdit()
+    edit.set_date_taken(new_date.exif)
+    if new_date.offset is not None:
+        edit.set_offset_time(new_date.offset)
+    else:
+        edit.replace_offset_time(UTC_OFFSET)
+    return edit
+
+
+@dataclass
+class MetadataEdit:
+    """
+    All the changes to make to the EXIF data of one photo, so that
+    `apply_metadata_edit()` can make them with a single write, however many
+    there are.
+
+    Tags are keyed like `JpegHeader.tags`, and the values are in the form
+    piexif uses: strings for ASCII tags, tuples of (numerator, denominator)
+    pairs for rationals, and so on.
+    """
+
+    tags: dict[tuple[str, int], Any] = field(default_factory=dict)
+    # Tags that are only changed if the photo already has them.
+    replacements: dict[tuple[str, int], Any] = field(default_factory=dict)
+
+    def set_date_taken(self, date: DateTime | bytes) -> None:
+        self.tags[("Exif", DATE_TIME_ORIGINAL)] = _exif_date_value(date)
+
+    def set_date_digitized(self, date: DateTime | bytes) -> None:
+        self.tags[("Exif", DATE_TIME_DIGITIZED)] = _exif_date_value(date)
+
+    def set_date_modified(self, date: DateTime | bytes) -> None:
+        self.tags[("0th", DATE_TIME)] = _exif_date_value(date)
+
+    def set_offset_time(self, offset: str) -> None:
+        """
+        `offset` is the UTC offset of the date taken, like "+01:00".
+        """
+        self.tags[("Exif", OFFSET_TIME_ORIGINAL)] = offset
+
+    def replace_offset_time(self, offset: str) -> None:
+        """
+        Like `set_offset_time()`, but only if the photo already has one.
+        """
+        self.replacements[("Exif", OFFSET_TIME_ORIGINAL)] = offset
+
+    def set_description(self, description: str) -> None:
+        """
+        EXIF says ImageDescription is ASCII, but post text often isn't, so
+        it's written as UTF-8, which is what most readers expect.
+        """
+        self.tags[("0th", IMAGE_DESCRIPTION)] = description.encode("utf-8")
+
+    def set_gps(self, latitude: float, longitude: float) -> None:
+        self.tags[("GPS", GPS_VERSION_ID)] = (2, 2, 0, 0)
+        self.tags[("GPS", GPS_LATITUDE_REF)] = "N" if latitude >= 0 else "S"
+        self.tags[("GPS", GPS_LATITUDE)] = _degrees_to_rationals(latitude)
+        self.tags[("GPS", GPS_LONGITUDE_REF)] = "E" if longitude >= 0 else "W"
+        self.tags[("GPS", GPS_LONGITUDE)] = _degrees_to_rationals(longitude)
+
+
+def _exif_date_value(date: DateTime | bytes) -> str | bytes:
+    """
+    Converts `date` to the EXIF date format: "YYYY:MM:DD HH:MM:SS". It can
+    also be a date that's already formatted, like `exif_date_bytes()` returns.
+    """
+    if isinstance(date, bytes):
+        return date.removesuffix(b"\0")
+    return format_exif_date(date)
+
+
+def _degrees_to_rationals(value: float) -> tuple[tuple[int, int], ...]:
+    """
+    Converts a latitude or longitude into the degrees, minutes and seconds
+    rationals EXIF uses for GPS coordinates.
+    """
+    # Rounding to hundredths of a second first means the seconds can't round
+    # up to 60.
+    hundredths = round(abs(value) * 3600 * 100)
+    degrees, hundredths = divmod(hundredths, 3600 * 100)
+    minutes, hundredths = divmod(hundredths, 60 * 100)
+    return ((degrees, 1), (minutes, 1), (hundredths, 100))
+
+
+def apply_metadata_edit(photo_path: str, edit: MetadataEdit) -> bool:
+    """
+    Makes all the changes in `edit` to the JPEG at `photo_path`. Returns
+    whether the photo was changed.
+
+    If every tag being changed is a string the photo already has, with the same
+    length, the new values are written over the old ones where they are, rather
+    than rewriting the whole file. That only needs the first few KB of the
+    file, so it's also cheap to check whether the values are already right,
+    which they will be when rerunning. Otherwise, the whole file is rewritten
+    once, with piexif.
+    """
+    patches = _plan_in_place_patches(photo_path, edit)
+    if patches is not None:
+        if not patches:
+            return False
+        make_private(photo_path)
+        with open(photo_path, "r+b") as file:
+            for offset, value in patches:
+                file.seek(offset)
+                file.write(value)
+        return True
 
     # Load the EXIF data from the photo
     exif_dict = piexif.load(photo_path)
 
-    # Convert the new date to the EXIF date format: "YYYY:MM:DD HH:MM:SS"
-    formatted_date = new_date.strftime("%Y:%m:%d %H:%M:%S")
-
-    # Modify the DateTimeOriginal field
-    exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = formatted_date
+    # Make all the changes at once
+    _apply_to_exif_dict(exif_dict, edit)
 
     # Convert EXIF data back to binary
     exif_bytes = piexif.dump(exif_dict)
 
     # Write the modified EXIF data back to the photo
+    make_private(photo_path)
     piexif.insert(exif_bytes, photo_path)
 
+    return True
 
-def read_json(filename: str) -> Any:
-    with open(filename, "r") as file:
-        return json.load(file)
 
+def _apply_to_exif_dict(exif_dict: dict, edit: MetadataEdit) -> None:
+    """
+    Makes the changes in `edit` to `exif_dict`, as loaded by piexif.
+    """
+    for (ifd, tag), value in edit.tags.items():
+        exif_dict[ifd][tag] = value
+    for (ifd, tag), value in edit.replacements.items():
+        if tag in exif_dict[ifd]:
+            exif_dict[ifd][tag] = value
 
-def main() -> None:
-    # First, go through all the conversations and collect all of the photos.
-    message_dirs = get_all_message_dirs()
-    all_message_photos: list[Photo] = []
-    for message_dir in message_dirs:
-        conversation = merge_conversation(message_dir)
-        message_photos = extract_photos_from_messages(conversation["messages"])
-        all_message_photos.extend(message_photos)
 
-    # Then we can get the photos from the albums.
-    album_photos = get_photos_from_album(ALBUM_DIR)
+def _plan_in_place_patches(
+    photo_path: str, edit: MetadataEdit
+) -> list[tuple[int, bytes]] | None:
+    """
+    Works out the (offset, bytes) writes that would make the changes in `edit`
+    without rewriting the file, leaving out values that are already right.
+    Returns None if the changes can't all be made that way.
+    """
+    header = read_jpeg_header(photo_path)
+    if header is None:
+        return None
 
-    # Then, we get the uncategorized photos, which are in the same format as
-    # the albums.
-    uncategorized = read_json(UNCATEGORIZED_PHOTOS)
-    uncategorized = uncategorized["other_photos_v2"]
-    uncategorized_photos = extract_photos_from_list(uncategorized)
-
-    # Lastly, we get all the photos from posts.
-    posts = read_json(POSTS_AND_CHECKINS)
-    posts_photos = extract_photos_from_posts(posts)
-
-    # Now we merge them into one.
-    all_photos = all_message_photos + album_photos + uncategorized_photos + posts_photos
-
-    # Finally, before editing the EXIF data, we append the URI root so the paths
-    # are correct, and convert the timestamp into a datetime object.
-    for photo in all_photos:
-        filepath = URI_ROOT + photo.uri
-        timestamp = datetime.datetime.fromtimestamp(photo.timestamp, datetime.UTC)
-        modify_date_taken(filepath, timestamp)
+    replacements = (
+        (key, value)
+        for key, value in edit.replacements.items()
+        if key in header.tags
+    )
+    patches = []
+    for (ifd, tag), value in itertools.chain(edit.tags.items(), replacements):
+        if isinstance(value, str) and value.isascii():
+            value = value.encode("ascii")
+        elif not isinstance(value, bytes):
+            return None
+        encoded = value + b"\0"
+        entry = header.tags.get((ifd, tag))
+        if entry is None or entry.type != TIFF_ASCII or entry.count != len(encoded):
+            return None
+        if header.read_tag(ifd, tag) != encoded:
+            patches.append((entry.offset, encoded))
+
+    return patches
+
+
+def modify_png_date_taken(photo_path: str, new_date: ExifDate) -> bool:
+    """
+    Sets the date taken of a PNG, by adding (or replacing) an eXIf chunk with
+    DateTimeOriginal in it, and an XMP iTXt chunk with the same date.
+
+    The file is streamed chunk by chunk into a new copy, so the image data is
+    never decoded or held in memory. Does nothing if the eXIf chunk already has
+    the right date.
+    """
+    edit = date_taken_edit(new_date)
+
+    existing_exif = read_png_exif(photo_path)
+    if existing_exif is not None:
+        tags = parse_exif_tags(existing_exif, 0)
+        replacements = (
+            (key, value) for key, value in edit.replacements.items() if key in tags
+        )
+        for key, value in itertools.chain(edit.tags.items(), replacements):
+            if isinstance(value, str):
+                value = value.encode("ascii")
+            entry = tags.get(key)
+            if entry is None or entry.count != len(value) + 1:
+                break
+            current = existing_exif[entry.offset : entry.offset + entry.count]
+            if current != value + b"\0":
+                break
+        else:
+            return False
+
+    # piexif can load bare TIFF data (which is what eXIf holds) as well as
+    # JPEGs, so any other tags already in there are kept.
+    if existing_exif is not None:
+        exif_dict = piexif.load(existing_exif)
+    else:
+        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+    _apply_to_exif_dict(exif_dict, edit)
+    exif_chunk = piexif.dump(exif_dict).removeprefix(EXIF_HEADER)
+    xmp_chunk = PNG_XMP_KEYWORD + b"\0\0\0\0\0" + make_xmp_packet(new_date)
+
+    directory = os.path.dirname(photo_path) or "."
+    with open(photo_path, "rb") as source, tempfile.NamedTemporaryFile(
+        dir=directory, delete=False
+    ) as target:
+        try:
+            target.write(source.read(len(PNG_SIGNATURE)))
+            for chunk_type, length in iter_png_chunks(source):
+                if chunk_type == b"eXIf" or (
+                    chunk_type == b"iTXt" and _is_xmp_chunk(source, length)
+                ):
+                    source.seek(length + 4, os.SEEK_CUR)
+                    continue
+
+                target.write(length.to_bytes(4, "big") + chunk_type)
+                copy_bytes(source, target, length + 4)
+                if chunk_type == b"IHDR":
+                    # The new chunks go straight after the header, so they're
+                    # before the image data, as the spec requires for eXIf.
+                    write_png_chunk(target, b"eXIf", exif_chunk)
+                    write_png_chunk(target, b"iTXt", xmp_chunk)
+        except BaseException:
+            target.close()
+            os.remove(target.name)
+            raise
+
+    shutil.copymode(photo_path, target.name)
+    os.replace(target.name, photo_path)
+    return True
+
+
+def iter_png_chunks(file: IO[bytes]) -> Iterator[tuple[bytes, int]]:
+    """
+    Yields the type and data length of each chunk in a PNG, starting from the
+    current position (just after the signature). Each time, the file is left at
+    the start of the chunk's data; the caller must move it past the data and
+    the 4 byte CRC before asking for the next chunk.
+    """
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        length = int.from_bytes(header[:4], "big")
+        chunk_type = header[4:]
+        yield chunk_type, length
+        if chunk_type == b"IEND":
+            return
+
+
+def read_png_exif(photo_path: str) -> bytes | None:
+    """
+    Returns the contents of the eXIf chunk of a PNG, or None if it doesn't have
+    one before the image data. Everything else is skipped over, not read.
+    """
+    with open(photo_path, "rb") as file:
+        if file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            return None
+        for chunk_type, length in iter_png_chunks(file):
+            if chunk_type == b"eXIf":
+                return file.read(length)
+            if chunk_type == b"IDAT":
+                return None
+            file.seek(length + 4, os.SEEK_CUR)
+
+    return None
+
+
+def _is_xmp_chunk(file: IO[bytes], length: int) -> bool:
+    """
+    Checks whether the iTXt chunk whose data starts at the current position
+    holds XMP, leaving the position where it was.
+    """
+    start = file.tell()
+    keyword = file.read(min(length, len(PNG_XMP_KEYWORD) + 1))
+    file.seek(start)
+    return keyword == PNG_XMP_KEYWORD + b"\0"
+
+
+def write_png_chunk(file: IO[bytes], chunk_type: bytes, data: bytes) -> None:
+    file.write(len(data).to_bytes(4, "big"))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(zlib.crc32(chunk_type + data).to_bytes(4, "big"))
+
+
+def copy_bytes(source: IO[bytes], target: IO[bytes], length: int) -> None:
+    """
+    Copies exactly `length` bytes from `source` to `target`, a block at a time.
+    """
+    while length > 0:
+        block = source.read(min(length, COPY_BUFFER_SIZE))
+        if not block:
+            raise EOFError("file ended early")
+        target.write(block)
+        length -= len(block)
+
+
+def make_xmp_packet(date: ExifDate) -> bytes:
+    """
+    Makes a minimal XMP packet with `date` as the date the photo was taken.
+    """
+    day, time = date.exif.removesuffix(b"\0").decode("ascii").split(" ")
+    iso_date = day.replace(":", "-") + "T" + time + (date.offset or "")
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about=""'
+        ' xmlns:exif="http://ns.adobe.com/exif/1.0/"'
+        ' xmlns:xmp="http://ns.adobe.com/xap/1.0/"'
+        f' exif:DateTimeOriginal="{iso_date}"'
+        f' xmp:CreateDate="{iso_date}"/>'
+        "</rdf:RDF>"
+        "</x:xmpmeta>"
+        '<?xpacket end="w"?>'
+    ).encode("utf-8")
+
+
+def modify_video_date_taken(video_path: str, new_date: ExifDate) -> bool:
+    """
+    Sets the creation and modification times of an MP4 or MOV file, in its
+    mvhd, tkhd and mdhd atoms.
+
+    These are fixed width fields, so they're overwritten where they are; the
+    rest of the file (which could be gigabytes) is never read or rewritten.
+    Only the fields that aren't already right are written. Raises ValueError
+    if the file doesn't have any, so it's reported as a failure rather than
+    as already having the right date.
+    """
+    seconds = new_date.timestamp - int(MP4_EPOCH.timestamp())
+
+    with open(video_path, "rb") as file:
+        fields = find_mp4_time_fields(file)
+    if not fields:
+        raise ValueError(f"{video_path} has no mvhd, tkhd or mdhd times")
+
+    patches = []
+    for offset, size, current in fields:
+        value = seconds.to_bytes(size, "big")
+        if value != current:
+            patches.append((offset, value))
+
+    if not patches:
+        return False
+
+    make_private(video_path)
+    with open(video_path, "r+b") as file:
+        for offset, value in patches:
+            file.seek(offset)
+            file.write(value)
+    return True
+
+
+def iter_mp4_boxes(
+    file: IO[bytes], start: int, end: int
+) -> Iterator[tuple[bytes, int, int]]:
+    """
+    Yields the type, payload offset and end offset of each box (atom) between
+    `start` and `end` in an MP4/MOV file, seeking past their contents.
+    """
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        size = int.from_bytes(header[:4], "big")
+        box_type = header[4:]
+        payload = position + 8
+        if size == 1:
+            # The real size is in the next 8 bytes.
+            size = int.from_bytes(file.read(8), "big")
+            payload += 8
+        elif size == 0:
+            # The box runs to the end of the file.
+            size = end - position
+        if size < payload - position:
+            return
+
+        yield box_type, payload, position + size
+        position += size
+
+
+def find_mp4_time_fields(file: IO[bytes]) -> list[tuple[int, int, bytes]]:
+    """
+    Finds the creation and modification time fields of the mvhd, and each
+    track's tkhd and mdhd, in an MP4/MOV file.
+
+    Returns the offset, size (4 or 8 bytes, depending on the atom's version)
+    and current value of each one.
+    """
+    fields: list[tuple[int, int, bytes]] = []
+    file_size = file.seek(0, os.SEEK_END)
+
+    def visit(start: int, end: int) -> None:
+        for box_type, payload, box_end in iter_mp4_boxes(file, start, end):
+            if box_type in MP4_CONTAINER_BOXES:
+                visit(payload, box_end)
+            elif box_type in MP4_TIME_BOXES:
+                file.seek(payload)
+                version = file.read(1)
+                size = 8 if version == b"\x01" else 4
+                # Skip the 3 bytes of flags.
+                file.seek(payload + 4)
+                times = file.read(size * 2)
+                if len(times) < size * 2:
+                    continue
+                fields.append((payload + 4, size, times[:size]))
+                fields.append((payload + 4 + size, size, times[size:]))
+
+    visit(0, file_size)
+    return fields
+
+
+class ExifEntry(NamedTuple):
+    """
+    One tag from the EXIF data of a photo. `offset` is where its value is in
+    the file.
+    """
+
+    type: int
+    count: int
+    offset: int
+
+
+@dataclass
+class JpegHeader:
+    """
+    Everything before the image data of a JPEG, as read by `read_jpeg_header()`.
+    """
+
+    # (marker, payload offset, payload length) for each segment before SOS.
+    segments: list[tuple[int, int, int]]
+    # The raw payload of the EXIF APP1 segment, and where it is in the file.
+    exif: bytes | None = None
+    exif_offset: int | None = None
+    # The EXIF tags, keyed by IFD name ("0th", "Exif" or "GPS", like piexif)
+    # and tag number.
+    tags: dict[tuple[str, int], ExifEntry] = field(default_factory=dict)
+
+    def read_tag(self, ifd: str, tag: int) -> bytes | None:
+        """
+        Returns the raw value of a tag, or None if the photo doesn't have it.
+        """
+        entry = self.tags.get((ifd, tag))
+        if entry is None or self.exif is None or self.exif_offset is None:
+            return None
+        start = entry.offset - self.exif_offset
+        size = TIFF_TYPE_SIZES.get(entry.type, 1) * entry.count
+        return self.exif[start : start + size]
+
+
+def read_jpeg_header(photo_path: str) -> JpegHeader | None:
+    """
+    Reads the segments at the start of the JPEG at `photo_path`, stopping as
+    soon as the image data starts, so only the first few KB of the file are
+    read. Only the EXIF segment's payload is actually read; everything else is
+    skipped over.
+
+    Returns None if the file isn't a JPEG.
+    """
+    with open(photo_path, "rb") as file:
+        if file.read(2) != JPEG_SOI:
+            return None
+
+        header = JpegHeader(segments=[])
+        while True:
+            marker_bytes = file.read(4)
+            if len(marker_bytes) < 4 or marker_bytes[0] != 0xFF:
+                break
+            marker = marker_bytes[1]
+            if marker in (JPEG_SOS, JPEG_EOI):
+                break
+
+            offset = file.tell()
+            length = int.from_bytes(marker_bytes[2:4], "big") - 2
+            header.segments.append((marker, offset, length))
+            if marker == JPEG_APP1 and header.exif is None:
+                payload = file.read(length)
+                if payload.startswith(EXIF_HEADER):
+                    header.exif = payload
+                    header.exif_offset = offset
+            else:
+                file.seek(length, os.SEEK_CUR)
+
+    if header.exif is not None:
+        header.tags = parse_exif_tags(
+            header.exif[len(EXIF_HEADER) :], header.exif_offset + len(EXIF_HEADER)
+        )
+
+    return header
+
+
+def parse_exif_tags(tiff: bytes, file_offset: int) -> dict[tuple[str, int], ExifEntry]:
+    """
+    Lists the tags in IFD0 and the Exif and GPS IFDs of `tiff` (the EXIF data,
+    minus the "Exif\0\0" header), which starts at `file_offset` in the file.
+    """
+    tags: dict[tuple[str, int], ExifEntry] = {}
+    if tiff[:2] not in (b"II", b"MM"):
+        return tags
+    byte_order = "little" if tiff[:2] == b"II" else "big"
+
+    def read_int(offset: int, size: int) -> int:
+        return int.from_bytes(tiff[offset : offset + size], byte_order)
+
+    def parse_ifd(name: str, ifd_offset: int) -> None:
+        if ifd_offset + 2 > len(tiff):
+            return
+        for index in range(read_int(ifd_offset, 2)):
+            entry = ifd_offset + 2 + index * 12
+            if entry + 12 > len(tiff):
+                return
+            tag = read_int(entry, 2)
+            value_type = read_int(entry + 2, 2)
+            count = read_int(entry + 4, 4)
+            # Values of 4 bytes or less are stored in the entry itself.
+            if TIFF_TYPE_SIZES.get(value_type, 1) * count <= 4:
+                value_offset = entry + 8
+            else:
+                value_offset = read_int(entry + 8, 4)
+            tags[(name, tag)] = ExifEntry(value_type, count, file_offset + value_offset)
+
+    parse_ifd("0th", read_int(4, 4))
+    for name, pointer_tag in (("Exif", EXIF_IFD_POINTER), ("GPS", GPS_IFD_POINTER)):
+        pointer = tags.get(("0th", pointer_tag))
+        if pointer is not None:
+            parse_ifd(name, read_int(pointer.offset - file_offset, 4))
+
+    return tags
+
+
+def sniff_media_type(path: str) -> str | None:
+    """
+    Works out the format of the file at `path` from its first few bytes, since
+    the extensions in the export can't be trusted (or are missing entirely).
+
+    Returns one of "jpeg", "png", "gif", "webp", "heic", "mp4" or "mov", or
+    None if it's something else. The result is remembered, so each file is
+    only opened once, however many times it's asked about.
+    """
+    if path in media_types:
+        return media_types[path]
+
+    with open_export_file(path) as file:
+        magic = file.read(SNIFF_SIZE)
+
+    media_type = None
+    if magic.startswith(b"\xff\xd8\xff"):
+        media_type = "jpeg"
+    elif magic.startswith(PNG_SIGNATURE):
+        media_type = "png"
+    elif magic.startswith((b"GIF87a", b"GIF89a")):
+        media_type = "gif"
+    elif magic[:4] == b"RIFF" and magic[8:12] == b"WEBP":
+        media_type = "webp"
+    elif magic[4:8] == b"ftyp":
+        brand = magic[8:12]
+        if brand in HEIC_BRANDS:
+            media_type = "heic"
+        elif brand == b"qt  ":
+            media_type = "mov"
+        elif brand in MP4_BRANDS or brand.startswith((b"3gp", b"3g2")):
+            media_type = "mp4"
+
+    media_types[path] = media_type
+    return media_type
+
+
+def is_editable_photo(photo_path: str) -> bool:
+    """
+    Returns whether `modify_date_taken()` knows how to edit `photo_path`.
+    Photos that are missing or can't be read (a directory, say, or a corrupt
+    zip member) can't be edited either; `edit_photo()` reports them as
+    missing or failed.
+    """
+    try:
+        return sniff_media_type(photo_path) in MEDIA_WRITERS
+    except Exception:
+        return False
+
+
+class ZipExport:
+    """
+    A Facebook export that's still in the zip files Facebook gave us, which
+    can be split into several parts. Each part holds a different subset of the
+    files, with paths relative to the export root (what `URI_ROOT` points at
+    when the export is unpacked).
+
+    All the parts are indexed up front, so listing directories doesn't need to
+    touch the zip files again.
+    """
+
+    def __init__(self, zip_paths: list[str]):
+        self.zip_paths = list(zip_paths)
+        self.members: dict[str, tuple[zipfile.ZipFile, zipfile.ZipInfo]] = {}
+        # Maps each directory to its children, and whether each is a directory.
+        self.children: dict[str, dict[str, bool]] = {"": {}}
+
+        for zip_path in self.zip_paths:
+            archive = zipfile.ZipFile(zip_path)
+            for info in archive.infolist():
+                parts = info.filename.rstrip("/").split("/")
+                for depth, name in enumerate(parts):
+                    parent = "/".join(parts[:depth])
+                    is_dir = depth < len(parts) - 1 or info.is_dir()
+                    siblings = self.children.setdefault(parent, {})
+                    siblings[name] = siblings.get(name, False) or is_dir
+                if not info.is_dir():
+                    self.members[info.filename] = (archive, info)
+
+    def listdir(self, path: str) -> list[str]:
+        if path not in self.children:
+            raise FileNotFoundError(path)
+        return list(self.children[path])
+
+    def subdirs(self, path: str) -> list[str]:
+        if path not in self.children:
+            raise FileNotFoundError(path)
+        return [name for name, is_dir in self.children[path].items() if is_dir]
+
+    def open(self, path: str) -> IO[bytes]:
+        if path not in self.members:
+            raise FileNotFoundError(path)
+        archive, info = self.members[path]
+        return archive.open(info)
+
+    def getsize(self, path: str) -> int:
+        if path not in self.members:
+            raise FileNotFoundError(path)
+        return self.members[path][1].file_size
+
+    def signature(self, path: str) -> tuple[int, int]:
+        if path not in self.members:
+            raise FileNotFoundError(path)
+        info = self.members[path][1]
+        return info.file_size, info.CRC
+
+    def extract(self, path: str, destination: str) -> None:
+        """
+        Copies the member at `path` out to the file `destination`.
+
+        The member is extracted to a temporary file first, so an interrupted
+        extraction never leaves a partial `destination` for the next run to
+        pick up.
+        """
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        partial = destination + ".partial"
+        with self.open(path) as source, open(partial, "wb") as target:
+            shutil.copyfileobj(source, target, EXTRACT_BUFFER_SIZE)
+        os.replace(partial, destination)
+
+
+def use_zip_export(zip_paths: list[str]) -> None:
+    """
+    Makes everything read the export out of the zip files in `zip_paths`,
+    instead of from `URI_ROOT`. An empty list goes back to reading from disk.
+    """
+    global export_archive
+
+    export_archive = ZipExport(zip_paths) if zip_paths else None
+
+
+def _archive_path(path: str) -> str:
+    """
+    Converts a path under `URI_ROOT` into a member name in the zip files.
+    """
+    relative = os.path.relpath(path, URI_ROOT).replace(os.sep, "/")
+    return "" if relative == "." else relative
+
+
+def list_export_dir(path: str) -> list[str]:
+    if export_archive is None:
+        return os.listdir(path)
+    return export_archive.listdir(_archive_path(path))
+
+
+def list_export_subdirs(path: str) -> list[str]:
+    """
+    Returns the full paths of the directories in `path`.
+    """
+    if export_archive is None:
+        with os.scandir(path) as iterator:
+            return [entry.path for entry in iterator if entry.is_dir()]
+    return [
+        os.path.join(path, name)
+        for name in export_archive.subdirs(_archive_path(path))
+    ]
+
+
+def open_export_file(path: str) -> IO[bytes]:
+    if export_archive is None:
+        return open(path, "rb")
+    return export_archive.open(_archive_path(path))
+
+
+def export_file_size(path: str) -> int:
+    if export_archive is None:
+        return os.path.getsize(path)
+    return export_archive.getsize(_archive_path(path))
+
+
+def export_file_signature(path: str) -> tuple[int, int]:
+    """
+    Returns a (size, mtime) pair that changes whenever the file at `path` does.
+    Zip members use their CRC in place of the mtime.
+    """
+    if export_archive is None:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    return export_archive.signature(_archive_path(path))
+
+
+def materialize_photo(photo_path: str) -> str:
+    """
+    Makes sure there's a copy of `photo_path` on disk that can be edited, and
+    returns its path.
+
+    When reading from zip files, this extracts just that one photo. With an
+    output directory, the photo is cloned into it with `link_or_clone()`;
+    otherwise it's edited where it is.
+    """
+    destination = edited_path(photo_path)
+    copied = output_dir is not None or export_archive is not None
+    if copied and os.path.exists(destination):
+        # Extracted or copied by an earlier run (and maybe already edited), so
+        # it only needs checking.
+        return destination
+
+    if export_archive is not None:
+        export_archive.extract(_archive_path(photo_path), destination)
+    elif output_dir is not None:
+        link_or_clone(photo_path, destination)
+
+    return destination
+
+
+def edited_path(photo_path: str) -> str:
+    """
+    Returns where the edited copy of `photo_path` (a path under `URI_ROOT`)
+    goes.
+    """
+    if output_dir is None:
+        return photo_path
+    return os.path.join(output_dir, os.path.relpath(photo_path, URI_ROOT))
+
+
+def use_output_dir(path: str | None) -> None:
+    """
+    Makes `edit_photos()` write edited copies of the photos into a parallel tree
+    at `path`, leaving the export untouched. None edits the export in place.
+    """
+    global output_dir
+
+    output_dir = path
+
+
+def clone_file(source: str, destination: str) -> bool:
+    """
+    Makes `destination` a reflink of `source`: a copy that shares the same
+    blocks on disk until one of them is changed, so it's instant and takes no
+    extra space. Only btrfs, XFS and a few other filesystems on Linux can do
+    this. Returns False if it couldn't be done.
+    """
+    if fcntl is None:
+        return False
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(destination)
+    return False
+
+
+def copy_file(source: str, destination: str) -> None:
+    """
+    Copies `source` to `destination` as cheaply as the filesystem allows: a
+    reflink if possible, then `copy_file_range` (which copies inside the
+    kernel, or on the server for NFS), then a normal copy.
+    """
+    if clone_file(source, destination):
+        return
+
+    if hasattr(os, "copy_file_range"):
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            try:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(
+                        src.fileno(), dst.fileno(), min(remaining, 1 << 30)
+                    )
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                else:
+                    return
+            except OSError:
+                pass
+
+    shutil.copyfile(source, destination)
+
+
+def link_or_clone(source: str, destination: str) -> None:
+    """
+    Puts `source` at `destination` without copying its data: a reflink if the
+    filesystem supports it, otherwise a hard link. Hard links are turned into
+    real copies by `make_private()` before anything writes to them, so files
+    that don't need changing never get copied.
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    if clone_file(source, destination):
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Different filesystems, or no hard links.
+        copy_file(source, destination)
+
+
+def make_private(path: str) -> None:
+    """
+    Called before writing to `path`. If it's a hard link in the output
+    directory, it's replaced with a copy first, so the export isn't changed
+    along with it.
+    """
+    if output_dir is None or os.stat(path).st_nlink < 2:
+        return
+
+    temporary = path + ".tmp"
+    copy_file(path, temporary)
+    shutil.copymode(path, temporary)
+    os.replace(temporary, path)
+
+
+class PhotoCache:
+    """
+    A SQLite file remembering which photos were extracted from each JSON file,
+    so reruns don't have to parse the JSON again. Entries are keyed by path and
+    checked against the file's size and mtime, so a file that has been
+    replaced is parsed again.
+
+    Changes are only saved by `commit()`.
+    """
+
+    # Bump this whenever extraction changes in a way that makes old entries
+    # wrong.
+    VERSION = 3
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != self.VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS files")
+            self.connection.execute(f"PRAGMA user_version = {self.VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, photos BLOB)"
+        )
+
+    def get(self, path: str, signature: tuple[int, int]) -> PhotoTable | None:
+        row = self.connection.execute(
+            "SELECT photos FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (path, *signature),
+        ).fetchone()
+        if row is None:
+            return None
+        return PhotoTable(map(PhotoRow._make, json.loads(row[0])))
+
+    def has(self, path: str, signature: tuple[int, int]) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (path, *signature),
+        ).fetchone()
+        return row is not None
+
+    def put(self, path: str, signature: tuple[int, int], photos: PhotoTable) -> None:
+        records = json.dumps([tuple(photo) for photo in photos])
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (path, *signature, records.encode()),
+        )
+
+    def clear(self) -> None:
+        self.connection.execute("DELETE FROM files")
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def use_photo_cache(path: str | None) -> None:
+    """
+    Makes the extract functions cache their results in the SQLite file at
+    `path`, or stop caching if `path` is None.
+    """
+    global photo_cache
+
+    if photo_cache is not None:
+        photo_cache.close()
+    photo_cache = PhotoCache(path) if path is not None else None
+
+
+def cached_photos(
+    file_path: str, extract: Callable[[str], PhotoTable]
+) -> PhotoTable:
+    """
+    Returns `extract(file_path)`, using the photo cache if it's enabled.
+    """
+    if photo_cache is None:
+        return extract(file_path)
+
+    signature = export_file_signature(file_path)
+    photos = photo_cache.get(file_path, signature)
+    if photos is None:
+        photos = extract(file_path)
+        photo_cache.put(file_path, signature, photos)
+
+    return photos
+
+
+def set_json_backend(name: str) -> None:
+    """
+    Forces `read_json()` to use a specific backend, one of the keys of
+    `JSON_BACKENDS`. By default the fastest installed one is used.
+    """
+    global json_backend
+
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"JSON backend {name!r} is not installed")
+    json_backend = name
+
+
+def read_json(filename: str) -> Any:
+    with open_export_file(filename) as file:
+        return JSON_BACKENDS[json_backend](file.read())
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Set the EXIF dates of photos in a Facebook data export."
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=["run", "plan", "apply", "verify", "invalidate-cache"],
+        help="'run' edits the photos (the default); 'plan' writes the edits "
+        "that 'run' would make to the --plan file, and 'apply' makes them; "
+        "'verify' lists the photos that don't have the right date yet; "
+        "'invalidate-cache' empties the cache of photos extracted from the "
+        "JSON files",
+    )
+    parser.add_argument(
+        "--json-backend",
+        choices=list(JSON_BACKENDS),
+        help="JSON parser to use (default: fastest installed)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="number of processes to parse conversations with (default: 1)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes to edit photos with (default: 1)",
+    )
+    parser.add_argument(
+        "--plan",
+        default=PLAN_PATH,
+        help=f"the edit plan for 'plan' and 'apply' (default: {PLAN_PATH})",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=(0, 1),
+        metavar="K/N",
+        help="with 'apply', only make the Kth of every N edits in the plan, so "
+        "N machines can share the work",
+    )
+    parser.add_argument(
+        "--zip",
+        nargs="+",
+        default=[],
+        metavar="ZIP",
+        help="read the export straight out of these zip files, extracting only "
+        "the photos that need editing into " + URI_ROOT,
+    )
+    parser.add_argument(
+        "--cache",
+        default=CACHE_PATH,
+        help="where to cache the photos extracted from each JSON file "
+        f"(default: {CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_const",
+        const=None,
+        dest="cache",
+        help="don't use the cache",
+    )
+    parser.add_argument(
+        "--journal",
+        help=f"where to record the progress of the run (default: {JOURNAL_PATH}, "
+        "or one per shard with --shard)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the photos the last run finished, and retry the ones it "
+        "didn't get to or failed on",
+    )
+    parser.add_argument(
+        "--dedupe-content",
+        action="store_true",
+        help="give photos with identical contents (but different names) the "
+        "same date",
+    )
+    parser.add_argument(
+        "--link-duplicates",
+        action="store_true",
+        help="with 'run', also replace photos with identical contents by "
+        "reflinks or hard links to one edited copy (implies --dedupe-content)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="write edited copies of the photos into this directory, leaving "
+        "the export untouched (copies are reflinks or hard links where possible)",
+    )
+    parser.add_argument(
+        "--disk-order",
+        action="store_true",
+        help="edit the photos in the order they're laid out on disk, rather "
+        "than the order they were found in (much faster on hard drives)",
+    )
+    parser.add_argument(
+        "--timezone",
+        type=parse_time_zone,
+        metavar="ZONE",
+        help="write dates as local time in this time zone (like Europe/London), "
+        "with their UTC offsets, rather than in UTC",
+    )
+    parser.add_argument(
+        "--timezone-map",
+        type=parse_time_zone_map,
+        metavar="FILE",
+        help="a JSON file mapping URI prefixes (like a conversation's directory) "
+        "to the time zones to use for the photos under them",
+    )
+    args = parser.parse_args(argv)
+    if args.command == "apply" and (args.timezone or args.timezone_map):
+        parser.error(
+            "the plan already has the dates in their time zones; "
+            "pass --timezone to 'plan' instead"
+        )
+    return args
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    if args.json_backend is not None:
+        set_json_backend(args.json_backend)
+    use_zip_export(args.zip)
+    use_photo_cache(args.cache)
+    use_output_dir(args.output_dir)
+    use_time_zones(args.timezone, args.timezone_map)
+
+    if args.command == "invalidate-cache":
+        if photo_cache is not None:
+            photo_cache.clear()
+            photo_cache.commit()
+        return
+
+    if args.command == "apply":
+        shard, shards = args.shard
+        all_photos, planned_dates = read_plan(args.plan, shard, shards)
+    else:
+        planned_dates = None
+        all_photos, duplicates = deduplicate_photos(collect_photos(args.jobs))
+        print(f"Found {len(all_photos)} photos, and skipped {duplicates} duplicates.")
+
+    links: list[tuple[str, str]] = []
+    if args.command != "apply" and (args.dedupe_content or args.link_duplicates):
+        links = deduplicate_content(all_photos, CONTENT_INDEX_PATH)
+    if args.command == "run" and args.link_duplicates:
+        # The duplicates will be replaced by links to the canonical copies,
+        # so there's no point editing them.
+        duplicate_uris = {duplicate for duplicate, _ in links}
+        all_photos = PhotoTable(p for p in all_photos if p.uri not in duplicate_uris)
+
+    if args.command == "plan":
+        write_plan(all_photos, args.plan)
+    elif args.command == "verify":
+        verify_photos(all_photos)
+    else:
+        journal_path = args.journal
+        if journal_path is None:
+            journal_path = JOURNAL_PATH
+            shard, shards = args.shard
+            if args.command == "apply" and shards > 1:
+                # Shards may run on different machines, so they can't share
+                # a SQLite file.
+                journal_path = JOURNAL_PATH.replace(
+                    ".sqlite", f".{shard + 1}-of-{shards}.sqlite"
+                )
+        journal = RunJournal(journal_path, resume=args.resume)
+        try:
+            edit_photos(
+                all_photos, journal, args.workers, args.disk_order, planned_dates
+            )
+        finally:
+            journal.commit()
+            journal.close()
+
+        if args.command == "run" and args.link_duplicates:
+            link_duplicates(links)
+
+
+def collect_photos(jobs: int = 1) -> PhotoTable:
+    """
+    Finds every photo in the export, along with the date it should have.
+    """
+    # Everything goes into one table as it's found, rather than into a list
+    # per source that are then joined together.
+    all_photos = PhotoTable()
+
+    # First, go through all the conversations and collect all of the photos.
+    message_dirs = get_all_message_dirs()
+    extract_photos_from_conversations(
+        message_dirs, jobs, into=all_photos, source="messages"
+    )
+
+    # Then we can get the photos from the albums.
+    get_photos_from_album(ALBUM_DIR, into=all_photos, source="album")
+
+    # Then, we get the uncategorized photos, which are in the same format as
+    # the albums.
+    all_photos.extend(
+        cached_photos(UNCATEGORIZED_PHOTOS, get_uncategorized_photos),
+        source="uncategorized",
+    )
+
+    # Then we get all the photos (and videos) from posts.
+    all_photos.extend(
+        cached_photos(POSTS_AND_CHECKINS, get_photos_from_posts_file), source="posts"
+    )
+
+    # Lastly, the videos, which have the same structure as photos.
+    try:
+        all_photos.extend(cached_photos(YOUR_VIDEOS, get_your_videos), source="videos")
+    except FileNotFoundError:
+        # Not every export has this file.
+        pass
+
+    if photo_cache is not None:
+        photo_cache.commit()
+
+    return all_photos
+
+
+def deduplicate_photos(photos: PhotoTable) -> tuple[PhotoTable, int]:
+    """
+    The same photo often turns up in several places (an album, the
+    uncategorized photos and a post, say), sometimes with different dates.
+    This keeps one entry per URI, in the order they first appear, so each
+    photo is only written once, and always with the same date no matter what
+    order they were found in.
+
+    When there's a conflict, a date the photo was taken beats an upload date,
+    and otherwise the earliest date wins.
+
+    Returns the photos that are left, and how many duplicates were dropped.
+    """
+    unique = PhotoTable()
+    # The row in `unique` of each URI.
+    rows: dict[str, int] = {}
+    for photo in photos:
+        row = rows.get(photo.uri)
+        if row is None:
+            rows[photo.uri] = len(unique)
+            unique.append(photo)
+        elif _photo_preference(photo) < _photo_preference(unique[row]):
+            unique.replace(row, photo)
+
+    return unique, len(photos) - len(unique)
+
+
+def _photo_preference(photo: Photo | PhotoRow) -> tuple[bool, int]:
+    return not photo.taken, photo.timestamp
+
+
+def new_content_hash() -> Any:
+    """
+    Returns a hash object for comparing file contents: xxHash or BLAKE3 if
+    they're installed, since they're much faster, otherwise BLAKE2.
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    if blake3 is not None:
+        return blake3.blake3()
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path: str, partial: bool = False) -> bytes:
+    """
+    Hashes the contents of the file at `path` (a path in the export).
+
+    With `partial`, only the first and last `PARTIAL_HASH_SIZE` bytes are
+    hashed, which is enough to tell most different files of the same size
+    apart without reading them in full.
+    """
+    content_hash = new_content_hash()
+    with open_export_file(path) as file:
+        if partial:
+            content_hash.update(file.read(PARTIAL_HASH_SIZE))
+            size = export_file_size(path)
+            if size > PARTIAL_HASH_SIZE * 2 and file.seekable():
+                file.seek(size - PARTIAL_HASH_SIZE)
+                content_hash.update(file.read(PARTIAL_HASH_SIZE))
+        else:
+            while block := file.read(COPY_BUFFER_SIZE):
+                content_hash.update(block)
+
+    return content_hash.digest()
+
+
+class ContentIndex:
+    """
+    Finds photos with identical contents under different URIs, which happens
+    when a photo is forwarded between chats or reposted.
+
+    Files are compared by size first, then by a hash of their first and last
+    few KB, and only files that still match are hashed in full, so most files
+    are never read at all. Everything is kept in a SQLite file rather than in
+    memory, so it copes with millions of photos.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        for table in ("files", "partial_hashes", "full_hashes"):
+            self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.connection.execute(
+            "CREATE TABLE files (uri TEXT PRIMARY KEY, row INTEGER, "
+            "size INTEGER, timestamp INTEGER, taken INTEGER)"
+        )
+        self.connection.execute("CREATE INDEX files_size ON files (size)")
+        self.connection.execute(
+            "CREATE TABLE partial_hashes (uri TEXT PRIMARY KEY, hash BLOB)"
+        )
+        self.connection.execute(
+            "CREATE TABLE full_hashes (uri TEXT PRIMARY KEY, hash BLOB)"
+        )
+
+    def add(self, photos: PhotoTable) -> None:
+        """
+        Adds `photos` to the index, along with the row each one is in, so
+        `groups()` can say where they are. Photos that aren't in the export are
+        left out.
+        """
+        def rows() -> Iterator[tuple[str, int, int, int, bool]]:
+            for row, photo in enumerate(photos):
+                try:
+                    size = export_file_size(URI_ROOT + photo.uri)
+                except FileNotFoundError:
+                    continue
+                yield photo.uri, row, size, photo.timestamp, photo.taken
+
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?)", rows()
+        )
+        self.connection.commit()
+
+    def _hash_matches(self, query: str, table: str, partial: bool) -> None:
+        """
+        Hashes every file returned by `query` into `table`, in batches. The
+        query is read a batch at a time too, so however many files match, only
+        one batch of URIs is in memory.
+        """
+        cursor = self.connection.execute(query)
+        while batch := [uri for (uri,) in cursor.fetchmany(HASH_BATCH_SIZE)]:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES (?, ?)",
+                ((uri, hash_file(URI_ROOT + uri, partial)) for uri in batch),
+            )
+            self.connection.commit()
+
+    def groups(self) -> Iterator[list[tuple[int, Photo]]]:
+        """
+        Hashes whatever needs hashing, then yields each group of photos with
+        identical contents, one group at a time, as (row, photo) pairs.
+        """
+        self._hash_matches(
+            "SELECT uri FROM files WHERE size IN "
+            "(SELECT size FROM files GROUP BY size HAVING COUNT(*) > 1)",
+            "partial_hashes",
+            partial=True,
+        )
+        self._hash_matches(
+            "WITH matches AS (SELECT size, hash FROM files "
+            "JOIN partial_hashes USING (uri) "
+            "GROUP BY size, hash HAVING COUNT(*) > 1) "
+            "SELECT uri FROM files JOIN partial_hashes USING (uri) "
+            "JOIN matches USING (size, hash)",
+            "full_hashes",
+            partial=False,
+        )
+
+        rows = self.connection.execute(
+            "WITH matches AS (SELECT size, hash FROM files "
+            "JOIN full_hashes USING (uri) "
+            "GROUP BY size, hash HAVING COUNT(*) > 1) "
+            "SELECT size, hash, row, uri, timestamp, taken FROM files "
+            "JOIN full_hashes USING (uri) JOIN matches USING (size, hash) "
+            "ORDER BY size, hash, uri"
+        )
+        for _, group in itertools.groupby(rows, key=lambda row: row[:2]):
+            yield [
+                (row, Photo(uri, timestamp, bool(taken)))
+                for _, _, row, uri, timestamp, taken in group
+            ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def deduplicate_content(
+    all_photos: PhotoTable, index_path: str
+) -> list[tuple[str, str]]:
+    """
+    Gives every photo with the same contents the same date, picked the same way
+    as `deduplicate_photos()` picks between duplicate URIs.
+
+    Returns (duplicate URI, canonical URI) pairs, where the canonical URI is
+    the photo whose date was picked, for `link_duplicates()`.
+    """
+    links: list[tuple[str, str]] = []
+    groups = 0
+
+    index = ContentIndex(index_path)
+    try:
+        index.add(all_photos)
+        for group in index.groups():
+            groups += 1
+            canonical = min((photo for _, photo in group), key=_photo_preference)
+            for row, member in group:
+                all_photos.set_date(row, canonical.timestamp, canonical.taken)
+                if member.uri != canonical.uri:
+                    links.append((member.uri, canonical.uri))
+    finally:
+        index.close()
+
+    print(f"Found {len(links)} copies of {groups} photos under other names.")
+    return links
+
+
+def link_duplicates(links: list[tuple[str, str]]) -> None:
+    """
+    Replaces each duplicate photo with a reflink (or failing that, a hard link)
+    to its canonical copy, after it's been edited, so the duplicates don't
+    take up space or need editing themselves.
+    """
+    for duplicate_uri, canonical_uri in links:
+        canonical = edited_path(URI_ROOT + canonical_uri)
+        duplicate = edited_path(URI_ROOT + duplicate_uri)
+        if not os.path.exists(canonical):
+            continue
+
+        os.makedirs(os.path.dirname(duplicate) or ".", exist_ok=True)
+        temporary = duplicate + ".tmp"
+        if not clone_file(canonical, temporary):
+            os.link(canonical, temporary)
+        os.replace(temporary, duplicate)
+
+
+def exif_date_bytes(timestamp: int) -> bytes:
+    """
+    Formats a Unix timestamp as a 20 byte EXIF date, "YYYY:MM:DD HH:MM:SS\0".
+    """
+    date = datetime.datetime.fromtimestamp(timestamp, datetime.UTC)
+    return format_exif_date(date).encode("ascii") + b"\0"
+
+
+def format_exif_date(date: DateTime) -> str:
+    """
+    Formats `date` as an EXIF date, "YYYY:MM:DD HH:MM:SS".
+    """
+    # strftime's %Y doesn't pad years before 1000 to four digits everywhere.
+    return f"{date.year:04d}" + date.strftime(EXIF_DATE_FORMAT)
+
+
+def format_exif_dates(timestamps: Iterable[int]) -> list[bytes | None]:
+    """
+    Formats every timestamp in `timestamps` (such as `PhotoTable.timestamps`)
+    like `exif_date_bytes()`.
+
+    With NumPy, this is done for the whole array at once, rather than making a
+    datetime and calling strftime for each one. Timestamps too far in the past
+    or future to be EXIF dates come back as None, and `edit_photo()` reports
+    them as failures.
+    """
+    if numpy is None:
+        return [_try_exif_date_bytes(timestamp) for timestamp in timestamps]
+
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    valid = (timestamps >= MIN_EXIF_TIMESTAMP) & (timestamps <= MAX_EXIF_TIMESTAMP)
+    days, seconds = numpy.divmod(numpy.where(valid, timestamps, 0), 86400)
+    day_dates = days.astype("datetime64[D]")
+    month_dates = day_dates.astype("datetime64[M]")
+    months = month_dates.astype(numpy.int64)
+    years = months // 12 + 1970
+
+    # Every date is written into a copy of a template, two digits at a time:
+    # `pairs[n]` is the two ASCII digits of n, as one 16 bit number, and the
+    # layout puts each of those where it goes in a 20 byte EXIF date.
+    pairs = numpy.frombuffer(
+        "".join(f"{n:02d}" for n in range(100)).encode("ascii"), numpy.uint16
+    )
+    layout = numpy.dtype(
+        {
+            "names": ["century", "year", "month", "day", "hour", "minute", "second"],
+            "formats": [numpy.uint16] * 7,
+            "offsets": [0, 2, 5, 8, 11, 14, 17],
+            "itemsize": EXIF_DATE_LENGTH,
+        }
+    )
+    text = bytearray(b"0000:00:00 00:00:00\0" * len(timestamps))
+    dates = numpy.frombuffer(text, layout)
+    dates["century"] = pairs[years // 100]
+    dates["year"] = pairs[years % 100]
+    dates["month"] = pairs[months % 12 + 1]
+    dates["day"] = pairs[(day_dates - month_dates).astype(numpy.int64) + 1]
+    dates["hour"] = pairs[seconds // 3600]
+    dates["minute"] = pairs[seconds // 60 % 60]
+    dates["second"] = pairs[seconds % 60]
+
+    packed = bytes(text)
+    formatted: list[bytes | None] = [
+        packed[start : start + EXIF_DATE_LENGTH]
+        for start in range(0, len(packed), EXIF_DATE_LENGTH)
+    ]
+    for index in numpy.flatnonzero(~valid):
+        formatted[index] = None
+    return formatted
+
+
+def _try_exif_date_bytes(timestamp: int) -> bytes | None:
+    if not MIN_EXIF_TIMESTAMP <= timestamp <= MAX_EXIF_TIMESTAMP:
+        return None
+    return exif_date_bytes(timestamp)
+
+
+def photo_exif_dates(
+    photos: PhotoTable,
+) -> tuple[list[bytes | None], list[str | None]]:
+    """
+    Returns the EXIF date of every photo in `photos`, formatted by
+    `format_exif_dates()`, and its UTC offset. The dates are in UTC, with no
+    offset, unless `use_time_zones()` has been called.
+    """
+    if time_zones is None:
+        return format_exif_dates(photos.timestamps), [None] * len(photos)
+
+    local_timestamps, offsets = time_zones.localize(photos)
+    return format_exif_dates(local_timestamps), offsets
+
+
+class ZoneOffsets:
+    """
+    The UTC offset of a time zone between two times, as a table of the times
+    the offset changes. Looking an offset up in it is a binary search, which
+    is much quicker than asking zoneinfo for every photo.
+    """
+
+    def __init__(self, zone: datetime.tzinfo, start: int, end: int):
+        # `offsets[i]` is the offset from `starts[i]` until `starts[i + 1]`.
+        self.starts = array("q", [start])
+        self.offsets = array("q", [self._offset_at(zone, start)])
+
+        previous = start
+        while previous < end:
+            probe = min(previous + ZONE_PROBE_INTERVAL, end)
+            offset = self._offset_at(zone, probe)
+            if offset != self.offsets[-1]:
+                # Find the first second with the new offset.
+                low, high = previous, probe
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if self._offset_at(zone, middle) == self.offsets[-1]:
+                        low = middle
+                    else:
+                        high = middle
+                self.starts.append(high)
+                self.offsets.append(offset)
+            previous = probe
+
+    @staticmethod
+    def _offset_at(zone: datetime.tzinfo, timestamp: int) -> int:
+        offset = DateTime.fromtimestamp(timestamp, zone).utcoffset()
+        return int(offset.total_seconds()) if offset is not None else 0
+
+    def offset_at(self, timestamp: int) -> int:
+        return self.offsets[max(bisect_right(self.starts, timestamp) - 1, 0)]
+
+    def offsets_at(self, timestamps: Any) -> Any:
+        """
+        `offset_at()` for a whole NumPy array of timestamps at once.
+        """
+        index = numpy.searchsorted(self.starts, timestamps, side="right") - 1
+        return numpy.asarray(self.offsets)[numpy.maximum(index, 0)]
+
+
+class TimeZones:
+    """
+    The time zone to write each photo's date in: `default`, unless the photo
+    is under one of the URI prefixes in `zones_by_prefix` (a conversation, or
+    the media of an album, say), in which case it's the zone of the longest
+    one that matches.
+    """
+
+    def __init__(
+        self,
+        default: datetime.tzinfo,
+        zones_by_prefix: dict[str, datetime.tzinfo] | None = None,
+    ):
+        self.default = default
+        self.zones_by_prefix = {
+            prefix.rstrip("/"): zone for prefix, zone in (zones_by_prefix or {}).items()
+        }
+
+    def zone_for(self, directory: str) -> datetime.tzinfo:
+        best = None
+        for prefix in self.zones_by_prefix:
+            if directory == prefix or directory.startswith(prefix + "/"):
+                if best is None or len(prefix) > len(best):
+                    best = prefix
+        return self.default if best is None else self.zones_by_prefix[best]
+
+    def localize(self, photos: PhotoTable) -> tuple[Any, list[str | None]]:
+        """
+        Returns the timestamps of `photos` moved into their time zones, so
+        that formatting them as if they were UTC gives the local time, and
+        their UTC offsets in EXIF form, like "+01:00".
+        """
+        if not len(photos):
+            return [], []
+
+        # The zone is the same for every photo in a directory, so only look
+        # it up once for each.
+        zones: list[datetime.tzinfo] = []
+        zone_ids: dict[datetime.tzinfo, int] = {}
+        directory_zones = []
+        for directory in photos.directories:
+            zone = self.zone_for(directory)
+            if zone not in zone_ids:
+                zone_ids[zone] = len(zones)
+                zones.append(zone)
+            directory_zones.append(zone_ids[zone])
+
+        # A day is left at each end so the local times stay in range.
+        start = max(min(photos.timestamps), MIN_EXIF_TIMESTAMP + 86400)
+        end = min(max(photos.timestamps), MAX_EXIF_TIMESTAMP - 86400)
+        tables = [ZoneOffsets(zone, start, max(start, end)) for zone in zones]
+
+        if numpy is None:
+            offsets = [
+                tables[directory_zones[directory_id]].offset_at(timestamp)
+                for directory_id, timestamp in zip(
+                    photos.directory_ids, photos.timestamps
+                )
+            ]
+            local_timestamps = [t + o for t, o in zip(photos.timestamps, offsets)]
+        else:
+            timestamps = numpy.asarray(photos.timestamps)
+            row_zones = numpy.asarray(directory_zones)[
+                numpy.asarray(photos.directory_ids)
+            ]
+            offsets = numpy.zeros(len(photos), dtype=numpy.int64)
+            for zone_id, table in enumerate(tables):
+                rows = numpy.flatnonzero(row_zones == zone_id)
+                offsets[rows] = table.offsets_at(timestamps[rows])
+            local_timestamps = timestamps + offsets
+            offsets = offsets.tolist()
+
+        # There are only a few different offsets, so each is formatted once.
+        names = {offset: format_utc_offset(offset) for offset in set(offsets)}
+        return local_timestamps, [names[offset] for offset in offsets]
+
+
+def format_utc_offset(offset: int) -> str:
+    """
+    Formats an offset from UTC, in seconds, the way EXIF's OffsetTime tags
+    have it: "+HH:MM" or "-HH:MM".
+    """
+    sign = "-" if offset < 0 else "+"
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
+
+
+def parse_time_zone(name: str) -> datetime.tzinfo:
+    """
+    Looks up an IANA time zone, like "Europe/London", for --timezone.
+    """
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise argparse.ArgumentTypeError(f"unknown time zone {name!r}")
+
+
+def parse_time_zone_map(path: str) -> dict[str, datetime.tzinfo]:
+    """
+    Reads the JSON file of URI prefixes and time zones for --timezone-map.
+    """
+    try:
+        with open(path, "rb") as file:
+            zone_map = json.loads(file.read())
+    except OSError as e:
+        raise argparse.ArgumentTypeError(f"can't read {path!r}: {e.strerror}")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{path!r} isn't valid JSON")
+
+    if not isinstance(zone_map, dict) or not all(
+        isinstance(name, str) for name in zone_map.values()
+    ):
+        raise argparse.ArgumentTypeError(
+            f"{path!r} should map URI prefixes to time zone names"
+        )
+    return {prefix: parse_time_zone(name) for prefix, name in zone_map.items()}
+
+
+def use_time_zones(
+    default: datetime.tzinfo | None,
+    zones_by_prefix: dict[str, datetime.tzinfo] | None = None,
+) -> None:
+    """
+    Makes `edit_photos()` write dates as local time in the `default` zone,
+    along with their UTC offsets, rather than in UTC.
+
+    `zones_by_prefix` maps URI prefixes (like a conversation's directory,
+    "your_activity_across_facebook/messages/inbox/friend_123") to the zones to
+    use for the photos under them instead. If both are None, dates are written
+    in UTC.
+    """
+    global time_zones
+
+    if default is None and zones_by_prefix is None:
+        time_zones = None
+        return
+
+    time_zones = TimeZones(default or datetime.UTC, zones_by_prefix)
+
+
+class EditResult(NamedTuple):
+    """
+    What `edit_photo()` did: "edited", "unchanged", "missing", "unsupported"
+    or "failed".
+    """
+
+    outcome: str
+    # The media type for "unsupported", or the error for "failed".
+    detail: str | None = None
+    # The (size, mtime) of the edited file, for "edited" and "unchanged".
+    signature: tuple[int, int] | None = None
+
+
+def edit_photo(
+    photo: Photo | PhotoRow,
+    exif_date: bytes | None = None,
+    offset: str | None = None,
+) -> EditResult:
+    """
+    Sets the date taken of a single photo. Any error is caught and returned as
+    a "failed" result, so one corrupt photo doesn't stop the whole run.
+
+    `exif_date` and `offset` are the photo's date, already formatted by
+    `photo_exif_dates()`. If `exif_date` is None, the date is formatted here,
+    in UTC.
+    """
+    # Before editing the EXIF data, we append the URI root so the paths are
+    # correct.
+    filepath = URI_ROOT + photo.uri
+    try:
+        media_type = sniff_media_type(filepath)
+    except FileNotFoundError:
+        return EditResult("missing")
+    except Exception as e:
+        return EditResult("failed", repr(e))
+    writer = MEDIA_WRITERS.get(media_type)
+    if writer is None:
+        try:
+            # The output directory (or the files extracted from the zips)
+            # should have every file in the export, not just the ones we edit.
+            materialize_photo(filepath)
+        except Exception as e:
+            return EditResult("failed", repr(e))
+        return EditResult("unsupported", media_type or "unknown")
+
+    try:
+        destination = materialize_photo(filepath)
+        if exif_date is None:
+            exif_date = exif_date_bytes(photo.timestamp)
+        changed = writer(destination, ExifDate(photo.timestamp, exif_date, offset))
+        outcome = "edited" if changed else "unchanged"
+        return EditResult(outcome, signature=file_signature(destination))
+    except Exception as e:
+        return EditResult("failed", repr(e))
+
+
+def edit_photos(
+    all_photos: PhotoTable,
+    journal: "RunJournal | None" = None,
+    workers: int = 1,
+    disk_order: bool = False,
+    dates: tuple[list[bytes | None], list[str | None]] | None = None,
+) -> None:
+    """
+    Sets the date taken of every photo in `all_photos`, using `workers`
+    processes. The dates are worked out by `photo_exif_dates()`, unless
+    `dates` gives them (from a plan, say), in the same form.
+
+    If `journal` is given, the outcome for each photo is recorded in it, and
+    photos it says were already finished (and haven't changed since) are
+    skipped.
+
+    If `disk_order` is true, the photos are edited in the order
+    `schedule_edits()` puts them in, rather than the order they're in.
+    """
+    if dates is None:
+        dates = photo_exif_dates(all_photos)
+    all_exif_dates, all_offsets = dates
+
+    # The journal has the date each photo was given, as it was written, so a
+    # run in a different time zone doesn't count as finished.
+    journal_dates = []
+    finished = {}
+    if journal is not None:
+        journal_dates = list(map(journal_date, all_exif_dates, all_offsets))
+        finished = journal.finished()
+        journal.plan(all_photos, journal_dates)
+
+    rows = []
+    resumed = 0
+    for row, photo in enumerate(all_photos):
+        if photo.uri in finished:
+            try:
+                signature = file_signature(edited_path(URI_ROOT + photo.uri))
+            except FileNotFoundError:
+                signature = None
+            if finished[photo.uri] == (journal_dates[row], signature):
+                resumed += 1
+                continue
+        rows.append(row)
+
+    todo = PhotoTable(all_photos[row] for row in rows)
+    if disk_order:
+        order = disk_order_rows(todo)
+        todo = PhotoTable(todo[i] for i in order)
+        rows = [rows[i] for i in order]
+    exif_dates = [all_exif_dates[row] for row in rows]
+    offsets = [all_offsets[row] for row in rows]
+
+    outcomes: Counter[str] = Counter()
+    failed: list[str] = []
+    unsupported: Counter[str] = Counter()
+    with contextlib.ExitStack() as stack:
+        if workers <= 1:
+            results: Iterable[EditResult] = map(edit_photo, todo, exif_dates, offsets)
+        else:
+            zip_paths = export_archive.zip_paths if export_archive is not None else []
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=(json_backend, zip_paths, output_dir),
+                )
+            )
+            results = executor.map(
+                edit_photo, todo, exif_dates, offsets, chunksize=EDIT_CHUNK_SIZE
+            )
+
+        for photo, result in zip(todo, results):
+            outcomes[result.outcome] += 1
+            if result.outcome == "unsupported":
+                unsupported[result.detail] += 1
+            elif result.outcome == "failed":
+                failed.append(URI_ROOT + photo.uri)
+
+            if journal is None:
+                continue
+            if result.outcome == "failed":
+                journal.record_failure(photo, result.detail)
+            elif result.signature is not None:
+                journal.record_success(photo, result.signature)
+
+    if journal is not None:
+        journal.commit()
+
+    print(
+        f"Edited {outcomes['edited']} photos, "
+        f"{outcomes['unchanged']} already had the right date."
+    )
+    if resumed:
+        print(f"Skipped {resumed} photos finished by an earlier run.")
+    if outcomes["missing"]:
+        print(f"Skipped {outcomes['missing']} photos that aren't in the export.")
+    for media_type, count in unsupported.most_common():
+        print(f"Skipped {count} files we can't edit yet ({media_type}).")
+    if failed:
+        print(f"Failed to edit {len(failed)} photos (rerun with --resume to retry):")
+        for filepath in failed:
+            print(f"  {filepath}")
+
+
+def schedule_edits(photos: PhotoTable) -> PhotoTable:
+    """
+    Returns `photos` in the order their files are laid out on disk: a
+    directory at a time, starting with the directory whose files come first,
+    and the files in each directory in order of where they are. On a hard
+    drive, that turns thousands of seeks back and forth between directories
+    into something close to one sweep across the disk.
+
+    Photos that can't be found (because they're missing, or still in a zip
+    file) go last, in the order they were in.
+    """
+    return PhotoTable(photos[row] for row in disk_order_rows(photos))
+
+
+def disk_order_rows(photos: PhotoTable) -> list[int]:
+    """
+    Returns the rows of `photos` in the order `schedule_edits()` puts them in.
+    """
+    locations: list[tuple[int, int, int] | None] = []
+    directory_starts: dict[int, tuple[int, int, int]] = {}
+    for row, photo in enumerate(photos):
+        try:
+            location = disk_location(URI_ROOT + photo.uri)
+        except OSError:
+            locations.append(None)
+            continue
+        locations.append(location)
+        directory_id = photos.directory_ids[row]
+        start = directory_starts.get(directory_id)
+        if start is None or location < start:
+            directory_starts[directory_id] = location
+
+    def key(row: int) -> tuple:
+        location = locations[row]
+        if location is None:
+            # `sorted()` is stable, so these stay in the order they were in.
+            return (True,)
+        directory_id = photos.directory_ids[row]
+        return (False, directory_starts[directory_id], directory_id, location)
+
+    return sorted(range(len(photos)), key=key)
+
+
+def disk_location(path: str) -> tuple[int, int, int]:
+    """
+    Returns where the file at `path` is on disk, as a (device, kind, position)
+    tuple that sorts in the order the files are laid out. The position is the
+    physical offset of the file's first block, from FIEMAP, on filesystems
+    that support it (kind 0). Otherwise it's the inode number (kind 1), which
+    most filesystems allocate roughly in order across the disk.
+
+    Offsets and inode numbers can't be compared with each other, so the kind
+    keeps them apart: files with no blocks mapped yet (empty ones, say, or
+    ones still waiting for delayed allocation) go after the rest.
+    """
+    stat = os.stat(path)
+    if fcntl is not None:
+        # Ask for the first extent of the whole file.
+        request = bytearray(FIEMAP_HEADER_SIZE + FIEMAP_EXTENT_SIZE)
+        request[8:16] = b"\xff" * 8
+        request[24:28] = (1).to_bytes(4, sys.byteorder)
+        try:
+            with open(path, "rb") as file:
+                fcntl.ioctl(file.fileno(), FS_IOC_FIEMAP, request)
+        except OSError:
+            pass
+        else:
+            mapped_extents = int.from_bytes(request[20:24], sys.byteorder)
+            if mapped_extents:
+                physical = request[FIEMAP_HEADER_SIZE + 8 : FIEMAP_HEADER_SIZE + 16]
+                return stat.st_dev, 0, int.from_bytes(physical, sys.byteorder)
+
+    return stat.st_dev, 1, stat.st_ino
+
+
+def write_plan(all_photos: PhotoTable, plan_path: str) -> None:
+    """
+    Writes an edit plan: one line of JSON per photo that we know how to edit,
+    with its URI, the date it should get, and where that date came from. The
+    date is there both as a timestamp and as it will be written, in its time
+    zone (see `use_time_zones()`), with its UTC offset. The plan can be
+    reviewed, and then carried out with `read_plan()` and `edit_photos()`,
+    possibly split across several machines.
+
+    Working out whether we can edit a photo only needs its first few bytes.
+    """
+    exif_dates, offsets = photo_exif_dates(all_photos)
+    planned = skipped = 0
+    with open(plan_path, "w") as file:
+        for photo, exif_date, offset in zip(all_photos, exif_dates, offsets):
+            if not is_editable_photo(URI_ROOT + photo.uri):
+                skipped += 1
+                continue
+            date = None if exif_date is None else exif_date[:-1].decode("ascii")
+            record = {
+                "uri": photo.uri,
+                "timestamp": photo.timestamp,
+                "date": date,
+                "offset": offset,
+                "taken": photo.taken,
+                "source": photo.source,
+            }
+            file.write(json.dumps(record) + "\n")
+            planned += 1
+
+    print(f"Planned {planned} edits, skipped {skipped} photos we can't edit.")
+
+
+def read_plan(
+    plan_path: str, shard: int = 0, shards: int = 1
+) -> tuple[PhotoTable, tuple[list[bytes | None], list[str | None]]]:
+    """
+    Reads the photos from an edit plan written by `write_plan()`, along with
+    the EXIF dates and UTC offsets to write, in the form `photo_exif_dates()`
+    returns them.
+
+    To split the plan between several machines, each one reads a different
+    `shard` out of `shards` (counting from 0). Every line of the plan belongs
+    to exactly one shard.
+    """
+    photos = PhotoTable()
+    exif_dates: list[bytes | None] = []
+    offsets: list[str | None] = []
+    with open(plan_path, "rb") as file:
+        for index, line in enumerate(file):
+            if index % shards != shard or not line.strip():
+                continue
+            record = JSON_BACKENDS[json_backend](line)
+            photos.add(
+                record["uri"],
+                record["timestamp"],
+                record["taken"],
+                record["source"],
+            )
+            date = record["date"]
+            exif_dates.append(None if date is None else date.encode("ascii") + b"\0")
+            offsets.append(record["offset"])
+
+    return photos, (exif_dates, offsets)
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """
+    Parses a --shard argument like "2/4" (the second of four shards) into a
+    0-based (shard, shards) pair.
+    """
+    try:
+        number, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {value!r}")
+    if not 1 <= number <= shards:
+        raise argparse.ArgumentTypeError(f"shard {number} isn't between 1 and {shards}")
+    return number - 1, shards
+
+
+def file_signature(path: str) -> tuple[int, int]:
+    """
+    Returns the (size, mtime) of the file at `path`.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class RunJournal:
+    """
+    A SQLite file recording what happened to each photo in a run, so a run
+    that crashed or was interrupted can carry on where it left off.
+
+    Each photo is planned as "pending", with the date it's being given (see
+    `journal_date()`), then marked "done" (along with the size and mtime of
+    the file afterwards, so we can tell if it changes later) or "failed".
+    Updates are committed in batches of `BATCH_SIZE`, so keeping the journal
+    doesn't slow the run down much; at worst, a crash loses the last batch,
+    and those photos are just checked again.
+    """
+
+    BATCH_SIZE = 1000
+    # Bump this whenever the table changes. Old journals are emptied, so their
+    # photos are just checked again.
+    VERSION = 1
+
+    def __init__(self, path: str, resume: bool = False):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != self.VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS edits")
+            self.connection.execute(f"PRAGMA user_version = {self.VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS edits ("
+            "uri TEXT PRIMARY KEY, date TEXT, state TEXT, "
+            "size INTEGER, mtime INTEGER, error TEXT)"
+        )
+        if not resume:
+            self.connection.execute("DELETE FROM edits")
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def finished(self) -> dict[str, tuple[str | None, tuple[int, int]]]:
+        """
+        Returns the photos marked as done, with the date they were given and
+        the (size, mtime) of the file afterwards.
+        """
+        rows = self.connection.execute(
+            "SELECT uri, date, size, mtime FROM edits WHERE state = 'done'"
+        )
+        return {uri: (date, (size, mtime)) for uri, date, size, mtime in rows}
+
+    def plan(
+        self, photos: Iterable[Photo | PhotoRow], dates: Iterable[str | None]
+    ) -> None:
+        """
+        Adds `photos` to the journal as pending, to be given `dates`. Photos
+        that are already in it keep their state, unless they now need a
+        different date.
+        """
+        self.connection.executemany(
+            "INSERT INTO edits (uri, date, state) VALUES (?, ?, 'pending') "
+            "ON CONFLICT (uri) DO UPDATE SET "
+            "state = CASE WHEN date IS excluded.date "
+            "THEN state ELSE 'pending' END, "
+            "date = excluded.date",
+            ((photo.uri, date) for photo, date in zip(photos, dates)),
+        )
+        self.connection.commit()
+
+    def record_success(
+        self, photo: Photo | PhotoRow, signature: tuple[int, int]
+    ) -> None:
+        self._record(photo, "done", signature, None)
+
+    def record_failure(self, photo: Photo | PhotoRow, error: str) -> None:
+        self._record(photo, "failed", (None, None), error)
+
+    def _record(
+        self,
+        photo: Photo | PhotoRow,
+        state: str,
+        signature: tuple[int | None, int | None],
+        error: str | None,
+    ) -> None:
+        self.connection.execute(
+            "UPDATE edits SET state = ?, size = ?, mtime = ?, error = ? "
+            "WHERE uri = ?",
+            (state, *signature, error, photo.uri),
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= self.BATCH_SIZE:
+            self.commit()
+
+    def commit(self) -> None:
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def journal_date(exif_date: bytes | None, offset: str | None) -> str | None:
+    """
+    The date a photo is given, as `RunJournal` keeps it: the EXIF date, and
+    its UTC offset if it has one, like "2017:07:14 02:40:02+09:00".
+    """
+    if exif_date is None:
+        return None
+    return exif_date.removesuffix(b"\0").decode("ascii") + (offset or "")
+
+
+def verify_photos(all_photos: PhotoTable) -> None:
+    """
+    Prints every photo whose date taken doesn't match its date in the export,
+    using the checker in `DATE_CHECKERS` for its format. This only reads the
+    headers of the photos, not the image data.
+    """
+    correct = wrong = 0
+    unchecked: Counter[str] = Counter()
+    exif_dates, offsets = photo_exif_dates(all_photos)
+    for photo, exif_date, offset in zip(all_photos, exif_dates, offsets):
+        source = URI_ROOT + photo.uri
+        filepath = edited_path(source)
+        try:
+            media_type = sniff_media_type(source)
+            checker = DATE_CHECKERS.get(media_type)
+            if checker is None:
+                unchecked[media_type or "unknown"] += 1
+                continue
+            right = exif_date is not None and checker(
+                filepath, ExifDate(photo.timestamp, exif_date, offset)
+            )
+        except OSError:
+            right = False
+        if right:
+            correct += 1
+        else:
+            wrong += 1
+            print(filepath)
+
+    print(f"{correct} photos have the right date, {wrong} don't.")
+    for media_type, count in unchecked.most_common():
+        print(f"Didn't check {count} files we can't read the date of ({media_type}).")
+
+
+def check_jpeg_date_taken(photo_path: str, new_date: ExifDate) -> bool:
+    header = read_jpeg_header(photo_path)
+    if header is None:
+        return False
+    return header.read_tag("Exif", DATE_TIME_ORIGINAL) == new_date.exif and (
+        _offset_matches(header.read_tag("Exif", OFFSET_TIME_ORIGINAL), new_date)
+    )
+
+
+def check_png_date_taken(photo_path: str, new_date: ExifDate) -> bool:
+    exif = read_png_exif(photo_path)
+    if exif is None:
+        return False
+    tags = parse_exif_tags(exif, 0)
+
+    def read_tag(key: tuple[str, int]) -> bytes | None:
+        entry = tags.get(key)
+        if entry is None:
+            return None
+        return exif[entry.offset : entry.offset + entry.count]
+
+    return read_tag(("Exif", DATE_TIME_ORIGINAL)) == new_date.exif and (
+        _offset_matches(read_tag(("Exif", OFFSET_TIME_ORIGINAL)), new_date)
+    )
+
+
+def _offset_matches(current: bytes | None, new_date: ExifDate) -> bool:
+    """
+    Checks `current`, the raw OffsetTimeOriginal of a photo (if it has one),
+    against the offset of `new_date`. A photo with its date in UTC doesn't
+    need an offset, but if it has one, it must be UTC's.
+    """
+    if new_date.offset is None and current is None:
+        return True
+    return current == (new_date.offset or UTC_OFFSET).encode("ascii") + b"\0"
+
+
+def check_video_date_taken(video_path: str, new_date: ExifDate) -> bool:
+    seconds = new_date.timestamp - int(MP4_EPOCH.timestamp())
+    with open(video_path, "rb") as file:
+        fields = find_mp4_time_fields(file)
+    return bool(fields) and all(
+        int.from_bytes(current, "big") == seconds for _, _, current in fields
+    )
+
+
+# The function that sets the date taken for each format `sniff_media_type()`
+# knows about. They take the path and the date, and return whether the file
+# was changed.
+MEDIA_WRITERS: dict[str | None, Callable[[str, ExifDate], bool]] = {
+    "jpeg": modify_jpeg_date_taken,
+    "png": modify_png_date_taken,
+    "mp4": modify_video_date_taken,
+    "mov": modify_video_date_taken,
+}
+
+# The function that checks the date taken for each format `verify_photos()`
+# can read the dates of. They take the path and the date it should have.
+DATE_CHECKERS: dict[str | None, Callable[[str, ExifDate], bool]] = {
+    "jpeg": check_jpeg_date_taken,
+    "png": check_png_date_taken,
+    "mp4": check_video_date_taken,
+    "mov": check_video_date_taken,
+}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The script isn't installed as a package, so make it importable from here.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+"""
+Tests for finding photos with identical contents under different names.
+"""
+import edit_photo_exif as epe
+
+
+def test_copies_get_the_date_of_the_best_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(epe, "URI_ROOT", str(tmp_path) + "/")
+    # Hash a few files at a time, so the batches are exercised.
+    monkeypatch.setattr(epe, "HASH_BATCH_SIZE", 3)
+
+    photos = epe.PhotoTable()
+    contents = {}
+    for number in range(20):
+        # Five different photos, four copies of each, all the same size.
+        contents[f"dir{number % 2}/{number}.jpg"] = b"photo %d" % (number % 5)
+    for uri, data in contents.items():
+        (tmp_path / uri).parent.mkdir(exist_ok=True)
+        (tmp_path / uri).write_bytes(data)
+        photos.add(uri, 1500000000 + len(photos))
+    # The last copy of photo 0 has a date it was taken, so that one wins.
+    photos.set_date(15, 1400000000, True)
+
+    links = epe.deduplicate_content(photos, str(tmp_path / "index.sqlite"))
+
+    assert len(links) == 15
+    for row, photo in enumerate(photos):
+        if row % 5 == 0:
+            assert (photo.timestamp, photo.taken) == (1400000000, True)
+        else:
+            # Otherwise the earliest date wins.
+            assert photo.timestamp == 1500000000 + row % 5
+    assert ("dir0/0.jpg", "dir1/15.jpg") in links
@@ -0,0 +1,70 @@
+"""
+Tests for `edit_photo()`, which edits one photo from the export.
+"""
+import zoneinfo
+
+import pytest
+
+import edit_photo_exif as epe
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    monkeypatch.setattr(epe, "URI_ROOT", str(tmp_path) + "/")
+    return tmp_path
+
+
+def test_missing_photo(export):
+    result = epe.edit_photo(epe.Photo("nothere.jpg", 1500000000))
+    assert result.outcome == "missing"
+
+
+def test_unreadable_photo_fails_without_stopping_the_run(export):
+    (export / "folder.jpg").mkdir()
+
+    result = epe.edit_photo(epe.Photo("folder.jpg", 1500000000))
+
+    assert result.outcome == "failed"
+    assert "IsADirectoryError" in result.detail
+
+
+def make_jpeg() -> bytes:
+    scan_header = b"\x01\x01\x00\x00\x3f\x00"
+    return (
+        epe.JPEG_SOI
+        + b"\xff\xda"
+        + (len(scan_header) + 2).to_bytes(2, "big")
+        + scan_header
+        + b"\x12" * 100
+        + b"\xff\xd9"
+    )
+
+
+def test_resume_in_another_time_zone_edits_again(export, monkeypatch, capsys):
+    monkeypatch.setattr(epe, "time_zones", None)
+    (export / "photo.jpg").write_bytes(make_jpeg())
+    photos = epe.PhotoTable([epe.Photo("photo.jpg", 1500000000)])
+    journal_path = str(export / "journal.sqlite")
+
+    epe.edit_photos(photos, epe.RunJournal(journal_path))
+    epe.edit_photos(photos, epe.RunJournal(journal_path, resume=True))
+    assert "Skipped 1 photos finished by an earlier run." in capsys.readouterr().out
+
+    epe.use_time_zones(zoneinfo.ZoneInfo("Asia/Tokyo"))
+    epe.edit_photos(photos, epe.RunJournal(journal_path, resume=True))
+
+    assert capsys.readouterr().out.startswith("Edited 1 photos")
+    local_date = epe.ExifDate(1500000000, b"2017:07:14 11:40:00\0", "+09:00")
+    assert epe.check_jpeg_date_taken(str(export / "photo.jpg"), local_date)
+
+
+def test_unsupported_file_is_still_in_the_output_dir(export, monkeypatch):
+    monkeypatch.setattr(epe, "output_dir", str(export / "out"))
+    (export / "photos").mkdir()
+    (export / "photos" / "animation.gif").write_bytes(b"GIF89a" + b"\0" * 20)
+
+    result = epe.edit_photo(epe.Photo("photos/animation.gif", 1500000000))
+
+    assert result == epe.EditResult("unsupported", "gif")
+    copy = export / "out" / "photos" / "animation.gif"
+    assert copy.read_bytes() == b"GIF89a" + b"\0" * 20
@@ -0,0 +1,31 @@
+from edit_photo_exif import (
+    MAX_EXIF_TIMESTAMP,
+    MIN_EXIF_TIMESTAMP,
+    exif_date_bytes,
+    format_exif_dates,
+)
+
+TIMESTAMPS = [
+    MIN_EXIF_TIMESTAMP,
+    -50000000000,  # 0385-07-25
+    -1,
+    0,
+    1500000000,
+    MAX_EXIF_TIMESTAMP,
+]
+
+
+def test_exif_date_bytes_pads_early_years():
+    assert exif_date_bytes(MIN_EXIF_TIMESTAMP) == b"0001:01:01 00:00:00\0"
+    assert exif_date_bytes(-50000000000) == b"0385:07:25 07:06:40\0"
+    assert exif_date_bytes(MAX_EXIF_TIMESTAMP) == b"9999:12:31 23:59:59\0"
+
+
+def test_format_exif_dates_matches_exif_date_bytes():
+    expected = [exif_date_bytes(timestamp) for timestamp in TIMESTAMPS]
+    assert format_exif_dates(TIMESTAMPS) == expected
+
+
+def test_format_exif_dates_skips_dates_out_of_range():
+    timestamps = [MIN_EXIF_TIMESTAMP - 1, 0, MAX_EXIF_TIMESTAMP + 1]
+    assert format_exif_dates(timestamps) == [None, exif_date_bytes(0), None]
@@ -0,0 +1,121 @@
+"""
+Tests for editing the dates of JPEGs, on tiny JPEGs built in memory.
+"""
+import datetime
+from datetime import datetime as DateTime
+
+import piexif
+
+import edit_photo_exif as epe
+
+NEW_DATE = DateTime(2017, 7, 14, 2, 40, 2, tzinfo=datetime.UTC)
+
+
+def make_jpeg(exif: dict | None) -> bytes:
+    """
+    Makes a JPEG with the given piexif-style EXIF data (or none), a scan
+    header and a few bytes of made up image data.
+    """
+    jpeg = epe.JPEG_SOI
+    if exif is not None:
+        payload = piexif.dump(exif)
+        jpeg += b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+    scan_header = b"\x01\x01\x00\x00\x3f\x00"
+    jpeg += b"\xff\xda" + (len(scan_header) + 2).to_bytes(2, "big") + scan_header
+    return jpeg + b"\x12" * 1000 + b"\xff\xd9"
+
+
+def exif_with(tags: dict) -> dict:
+    return {"0th": {}, "Exif": tags, "GPS": {}, "1st": {}, "thumbnail": None}
+
+
+def date_taken(path) -> bytes | None:
+    return piexif.load(str(path))["Exif"].get(piexif.ExifIFD.DateTimeOriginal)
+
+
+def test_existing_date_is_patched_in_place(tmp_path):
+    path = tmp_path / "photo.jpg"
+    original = make_jpeg(
+        exif_with({piexif.ExifIFD.DateTimeOriginal: "2001:01:01 00:00:00"})
+    )
+    path.write_bytes(original)
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    edited = path.read_bytes()
+    assert date_taken(path) == b"2017:07:14 02:40:02"
+    # Only the date itself changed.
+    assert len(edited) == len(original)
+    changed = [i for i, (a, b) in enumerate(zip(original, edited)) if a != b]
+    start = original.index(b"2001:01:01")
+    assert all(start <= i < start + 19 for i in changed)
+
+
+def test_missing_date_is_added(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(exif_with({piexif.ExifIFD.ExposureTime: (1, 60)})))
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    exif = piexif.load(str(path))["Exif"]
+    assert exif[piexif.ExifIFD.DateTimeOriginal] == b"2017:07:14 02:40:02"
+    assert exif[piexif.ExifIFD.ExposureTime] == (1, 60)
+
+
+def test_jpeg_without_exif_gets_a_date(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(None))
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+    assert date_taken(path) == b"2017:07:14 02:40:02"
+
+
+def test_editing_again_changes_nothing(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(None))
+    epe.modify_date_taken(str(path), NEW_DATE)
+    edited = path.read_bytes()
+
+    assert not epe.modify_date_taken(str(path), NEW_DATE)
+    assert path.read_bytes() == edited
+    assert epe.check_jpeg_date_taken(str(path), epe.ExifDate.from_datetime(NEW_DATE))
+
+
+def test_stale_offset_is_set_to_utc(tmp_path):
+    path = tmp_path / "photo.jpg"
+    original = make_jpeg(
+        exif_with(
+            {
+                piexif.ExifIFD.DateTimeOriginal: "2001:01:01 00:00:00",
+                piexif.ExifIFD.OffsetTimeOriginal: "+09:00",
+            }
+        )
+    )
+    path.write_bytes(original)
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    exif = piexif.load(str(path))["Exif"]
+    assert exif[piexif.ExifIFD.OffsetTimeOriginal] == b"+00:00"
+    # Both fit where the old values were.
+    assert len(path.read_bytes()) == len(original)
+    assert epe.check_jpeg_date_taken(str(path), epe.ExifDate.from_datetime(NEW_DATE))
+
+
+def test_offset_is_not_added_for_utc(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(None))
+
+    epe.modify_date_taken(str(path), NEW_DATE)
+
+    assert piexif.ExifIFD.OffsetTimeOriginal not in piexif.load(str(path))["Exif"]
+
+
+def test_check_notices_the_wrong_offset(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg(None))
+    date = epe.ExifDate.from_datetime(NEW_DATE)
+    epe.modify_jpeg_date_taken(str(path), date._replace(offset="+09:00"))
+
+    assert not epe.check_jpeg_date_taken(str(path), date)
+    assert epe.check_jpeg_date_taken(str(path), date._replace(offset="+09:00"))
@@ -0,0 +1,50 @@
+"""
+Tests for `MetadataEdit`, which makes several tag changes in one write.
+"""
+import datetime
+from datetime import datetime as DateTime
+
+import piexif
+
+import edit_photo_exif as epe
+
+NEW_DATE = DateTime(2017, 7, 14, 2, 40, 2, tzinfo=datetime.UTC)
+
+
+def make_jpeg() -> bytes:
+    scan_header = b"\x01\x01\x00\x00\x3f\x00"
+    return (
+        epe.JPEG_SOI
+        + b"\xff\xda"
+        + (len(scan_header) + 2).to_bytes(2, "big")
+        + scan_header
+        + b"\x12" * 100
+        + b"\xff\xd9"
+    )
+
+
+def test_date_gps_and_description_in_one_write(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(make_jpeg())
+    edit = epe.MetadataEdit()
+    edit.set_date_taken(NEW_DATE)
+    edit.set_description("Café 🎉")
+    edit.set_gps(51.5, -0.25)
+
+    assert epe.apply_metadata_edit(str(path), edit)
+
+    exif = piexif.load(str(path))
+    assert exif["Exif"][piexif.ExifIFD.DateTimeOriginal] == b"2017:07:14 02:40:02"
+    description = exif["0th"][piexif.ImageIFD.ImageDescription]
+    assert description.decode("utf-8") == "Café 🎉"
+    gps = exif["GPS"]
+    assert gps[piexif.GPSIFD.GPSLatitudeRef] == b"N"
+    assert gps[piexif.GPSIFD.GPSLatitude] == ((51, 1), (30, 1), (0, 100))
+    assert gps[piexif.GPSIFD.GPSLongitudeRef] == b"W"
+    assert gps[piexif.GPSIFD.GPSLongitude] == ((0, 1), (15, 1), (0, 100))
+
+
+def test_seconds_carry_into_minutes_and_degrees():
+    assert epe._degrees_to_rationals(10.9999999) == ((11, 1), (0, 1), (0, 100))
+    assert epe._degrees_to_rationals(-0.5) == ((0, 1), (30, 1), (0, 100))
+    assert epe._degrees_to_rationals(1.2345) == ((1, 1), (14, 1), (420, 100))
@@ -0,0 +1,76 @@
+"""
+Tests for editing the dates of MP4 videos, on tiny files built in memory.
+"""
+import datetime
+from datetime import datetime as DateTime
+
+import pytest
+
+import edit_photo_exif as epe
+
+NEW_DATE = DateTime(2017, 7, 14, 2, 40, 2, tzinfo=datetime.UTC)
+# The same date, in seconds since 1904.
+NEW_SECONDS = 3582844802
+OLD_SECONDS = 3000000000
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return (len(payload) + 8).to_bytes(4, "big") + box_type + payload
+
+
+def time_box(box_type: bytes, version: int) -> bytes:
+    """
+    Makes an mvhd, tkhd or mdhd box with the old creation and modification
+    times, followed by some padding standing in for the rest of its fields.
+    """
+    size = 8 if version == 1 else 4
+    times = OLD_SECONDS.to_bytes(size, "big") * 2
+    return box(box_type, bytes([version, 0, 0, 0]) + times + b"\x07" * 40)
+
+
+def make_mp4() -> bytes:
+    media = box(b"mdia", time_box(b"mdhd", 0) + box(b"hdlr", b"\x00" * 24))
+    track = box(b"trak", time_box(b"tkhd", 1) + media)
+    movie = box(b"moov", time_box(b"mvhd", 0) + track)
+    return box(b"ftyp", b"isom\x00\x00\x02\x00") + movie + box(b"mdat", b"\x42" * 1000)
+
+
+def test_times_are_patched_in_place(tmp_path):
+    path = tmp_path / "video.mp4"
+    original = make_mp4()
+    path.write_bytes(original)
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    edited = path.read_bytes()
+    assert len(edited) == len(original)
+    with open(path, "rb") as file:
+        fields = epe.find_mp4_time_fields(file)
+    # Creation and modification time of each of the three boxes.
+    assert len(fields) == 6
+    assert all(int.from_bytes(value, "big") == NEW_SECONDS for _, _, value in fields)
+    # Nothing but the time fields changed.
+    patched = bytearray(edited)
+    for offset, size, _ in fields:
+        patched[offset : offset + size] = OLD_SECONDS.to_bytes(size, "big")
+    assert bytes(patched) == original
+    assert epe.check_video_date_taken(str(path), epe.ExifDate.from_datetime(NEW_DATE))
+
+
+def test_editing_again_changes_nothing(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(make_mp4())
+    epe.modify_date_taken(str(path), NEW_DATE)
+    edited = path.read_bytes()
+
+    assert not epe.modify_date_taken(str(path), NEW_DATE)
+    assert path.read_bytes() == edited
+
+
+def test_video_without_times_is_an_error(tmp_path):
+    path = tmp_path / "video.mp4"
+    ftyp = box(b"ftyp", b"isom\x00\x00\x02\x00")
+    path.write_bytes(ftyp + box(b"mdat", b"\x42" * 100))
+
+    with pytest.raises(ValueError):
+        epe.modify_date_taken(str(path), NEW_DATE)
@@ -0,0 +1,45 @@
+import pytest
+
+from edit_photo_exif import PhotoRow, PhotoTable
+
+
+def test_extend_with_table_keeps_rows():
+    table = PhotoTable()
+    table.add("a/one.jpg", 1, source="album")
+    other = PhotoTable()
+    other.add("b/two.jpg", 2, taken=True, source="posts")
+    other.add("a/three.jpg", 3)
+
+    table.extend(other)
+
+    assert list(table) == [
+        PhotoRow("a/one.jpg", 1, False, "album"),
+        PhotoRow("b/two.jpg", 2, True, "posts"),
+        PhotoRow("a/three.jpg", 3, False, ""),
+    ]
+
+
+def test_extend_with_table_replaces_source():
+    table = PhotoTable()
+    table.add("a/one.jpg", 1, source="album")
+    other = PhotoTable()
+    other.add("b/two.jpg", 2, source="posts")
+    other.add("b/three.jpg", 3)
+
+    table.extend(other, source="messages")
+
+    assert [photo.source for photo in table] == ["album", "messages", "messages"]
+    assert table.uri(2) == "b/three.jpg"
+
+
+def test_negative_indexes_count_from_the_end():
+    table = PhotoTable()
+    table.add("a/b.jpg", 1)
+    table.add("c/d.jpg", 2, taken=True)
+
+    assert table[-1] == PhotoRow("c/d.jpg", 2, True, "")
+    assert table.uri(-2) == "a/b.jpg"
+    with pytest.raises(IndexError):
+        table[2]
+    with pytest.raises(IndexError):
+        table.uri(-3)
@@ -0,0 +1,57 @@
+"""
+Tests for writing edit plans and reading them back.
+"""
+import argparse
+import json
+import zoneinfo
+
+import pytest
+
+import edit_photo_exif as epe
+
+
+@pytest.fixture
+def export(tmp_path, monkeypatch):
+    monkeypatch.setattr(epe, "URI_ROOT", str(tmp_path) + "/")
+    monkeypatch.setattr(epe, "time_zones", None)
+    return tmp_path
+
+
+def test_plan_keeps_the_time_zone_for_apply(export):
+    (export / "photo.jpg").write_bytes(epe.JPEG_SOI + b"\xff\xd9")
+    photos = epe.PhotoTable([epe.Photo("photo.jpg", 1500000000)])
+    plan_path = str(export / "plan.jsonl")
+
+    epe.use_time_zones(zoneinfo.ZoneInfo("Asia/Tokyo"))
+    epe.write_plan(photos, plan_path)
+    # Applying doesn't depend on the zone the run is in.
+    epe.use_time_zones(None)
+    planned, (exif_dates, offsets) = epe.read_plan(plan_path)
+
+    with open(plan_path) as file:
+        record = json.loads(file.readline())
+    assert record["date"] == "2017:07:14 11:40:00"
+    assert record["offset"] == "+09:00"
+    assert list(planned) == list(photos)
+    assert exif_dates == [b"2017:07:14 11:40:00\0"]
+    assert offsets == ["+09:00"]
+
+
+def test_time_zone_map_with_an_unknown_zone(tmp_path):
+    path = tmp_path / "zones.json"
+    path.write_text('{"your_activity_across_facebook": "Mars/Olympus"}')
+
+    with pytest.raises(argparse.ArgumentTypeError, match="Mars/Olympus"):
+        epe.parse_time_zone_map(str(path))
+
+
+def test_plan_skips_photos_it_cant_read(export, capsys):
+    (export / "dir.jpg").mkdir()
+    (export / "photo.jpg").write_bytes(epe.JPEG_SOI + b"\xff\xd9")
+    photos = epe.PhotoTable(
+        [epe.Photo("dir.jpg", 1500000000), epe.Photo("photo.jpg", 1500000000)]
+    )
+
+    epe.write_plan(photos, str(export / "plan.jsonl"))
+
+    assert "Planned 1 edits, skipped 1 photos" in capsys.readouterr().out
@@ -0,0 +1,116 @@
+"""
+Tests for editing the dates of PNGs, on tiny PNGs built in memory.
+"""
+import datetime
+import zlib
+from datetime import datetime as DateTime
+
+import piexif
+
+import edit_photo_exif as epe
+
+NEW_DATE = DateTime(2017, 7, 14, 2, 40, 2, tzinfo=datetime.UTC)
+EXIF_DATE = epe.ExifDate.from_datetime(NEW_DATE)
+
+
+def chunk(chunk_type: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(chunk_type + data)
+    return len(data).to_bytes(4, "big") + chunk_type + data + crc.to_bytes(4, "big")
+
+
+def make_png(*extra_chunks: bytes) -> bytes:
+    """
+    Makes a 1x1 greyscale PNG, with `extra_chunks` after the header.
+    """
+    header = (1).to_bytes(4, "big") * 2 + b"\x08\x00\x00\x00\x00"
+    return (
+        epe.PNG_SIGNATURE
+        + chunk(b"IHDR", header)
+        + b"".join(extra_chunks)
+        + chunk(b"IDAT", zlib.compress(b"\x00\x80"))
+        + chunk(b"IEND", b"")
+    )
+
+
+def read_chunks(data: bytes) -> list[tuple[bytes, bytes]]:
+    """
+    Splits a PNG into its (type, data) chunks, checking every CRC.
+    """
+    assert data.startswith(epe.PNG_SIGNATURE)
+    chunks = []
+    position = len(epe.PNG_SIGNATURE)
+    while position < len(data):
+        length = int.from_bytes(data[position : position + 4], "big")
+        chunk_type = data[position + 4 : position + 8]
+        body = data[position + 8 : position + 8 + length]
+        crc = data[position + 8 + length : position + 12 + length]
+        assert zlib.crc32(chunk_type + body).to_bytes(4, "big") == crc
+        chunks.append((chunk_type, body))
+        position += 12 + length
+    return chunks
+
+
+def test_date_is_added_before_the_image_data(tmp_path):
+    path = tmp_path / "photo.png"
+    original = make_png()
+    path.write_bytes(original)
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    chunks = read_chunks(path.read_bytes())
+    types = [chunk_type for chunk_type, _ in chunks]
+    assert types == [b"IHDR", b"eXIf", b"iTXt", b"IDAT", b"IEND"]
+    exif = piexif.load(dict(chunks)[b"eXIf"])
+    assert exif["Exif"][piexif.ExifIFD.DateTimeOriginal] == b"2017:07:14 02:40:02"
+    assert b'exif:DateTimeOriginal="2017-07-14T02:40:02"' in dict(chunks)[b"iTXt"]
+    assert dict(chunks)[b"IDAT"] == dict(read_chunks(original))[b"IDAT"]
+    assert epe.check_png_date_taken(str(path), EXIF_DATE)
+
+
+def test_existing_exif_is_replaced_and_other_tags_kept(tmp_path):
+    path = tmp_path / "photo.png"
+    old_exif = piexif.dump(
+        {
+            "0th": {piexif.ImageIFD.Make: b"Camera"},
+            "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2001:01:01 00:00:00"},
+        }
+    ).removeprefix(epe.EXIF_HEADER)
+    path.write_bytes(make_png(chunk(b"eXIf", old_exif)))
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    chunks = read_chunks(path.read_bytes())
+    assert [chunk_type for chunk_type, _ in chunks].count(b"eXIf") == 1
+    exif = piexif.load(dict(chunks)[b"eXIf"])
+    assert exif["0th"][piexif.ImageIFD.Make] == b"Camera"
+    assert exif["Exif"][piexif.ExifIFD.DateTimeOriginal] == b"2017:07:14 02:40:02"
+
+
+def test_editing_again_changes_nothing(tmp_path):
+    path = tmp_path / "photo.png"
+    path.write_bytes(make_png())
+    epe.modify_date_taken(str(path), NEW_DATE)
+    edited = path.read_bytes()
+
+    assert not epe.modify_date_taken(str(path), NEW_DATE)
+    assert path.read_bytes() == edited
+
+
+def test_stale_offset_is_set_to_utc(tmp_path):
+    path = tmp_path / "photo.png"
+    old_exif = piexif.dump(
+        {
+            "Exif": {
+                piexif.ExifIFD.DateTimeOriginal: b"2017:07:14 02:40:02",
+                piexif.ExifIFD.OffsetTimeOriginal: b"+09:00",
+            },
+        }
+    ).removeprefix(epe.EXIF_HEADER)
+    path.write_bytes(make_png(chunk(b"eXIf", old_exif)))
+    assert not epe.check_png_date_taken(str(path), EXIF_DATE)
+
+    assert epe.modify_date_taken(str(path), NEW_DATE)
+
+    exif = piexif.load(dict(read_chunks(path.read_bytes()))[b"eXIf"])
+    assert exif["Exif"][piexif.ExifIFD.OffsetTimeOriginal] == b"+00:00"
+    assert epe.check_png_date_taken(str(path), EXIF_DATE)
@@ -0,0 +1,83 @@
+"""
+Tests for the byte scanner in `scan_photos_from_file()`, checked against the
+full JSON parser, which it has to agree with.
+"""
+import json
+
+import pytest
+
+import edit_photo_exif as epe
+
+
+def photo(uri: str, timestamp: int) -> dict:
+    return {"uri": uri, "creation_timestamp": timestamp}
+
+
+def full_parse(path) -> list:
+    with open(path, "rb") as file:
+        data = json.load(file)
+    return list(epe.extract_photos_from_messages(data.get("messages", [])))
+
+
+def write_page(path, data: dict) -> None:
+    path.write_text(json.dumps(data, indent=2, ensure_ascii=False), "utf-8")
+
+
+def test_photos_mentioned_in_message_text_are_ignored(tmp_path):
+    path = tmp_path / "message_1.json"
+    write_page(
+        path,
+        {
+            "participants": [{"name": "A"}],
+            "messages": [
+                {"content": 'the "photos": [ key', "timestamp_ms": 1},
+                {"photos": [photo("inbox/a/photos/1.jpg", 1500000000)]},
+                {"videos": [photo("inbox/a/videos/2.mp4", 1500000001)]},
+            ],
+        },
+    )
+
+    scanned = list(epe.scan_photos_from_file(str(path)))
+
+    uris = [p.uri for p in scanned]
+    assert uris == ["inbox/a/photos/1.jpg", "inbox/a/videos/2.mp4"]
+    assert scanned == full_parse(path)
+
+
+def test_photo_array_across_window_boundaries(tmp_path, monkeypatch):
+    monkeypatch.setattr(epe, "SCAN_WINDOW_SIZE", 16)
+    path = tmp_path / "message_1.json"
+    photos = [photo(f"inbox/a/photos/café_{n}.jpg", 1500000000 + n) for n in range(9)]
+    write_page(path, {"messages": [{"content": "ü" * 100, "photos": photos}]})
+
+    scanned = list(epe.scan_photos_from_file(str(path)))
+
+    assert len(scanned) == 9
+    assert scanned == full_parse(path)
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_page_without_messages(tmp_path, monkeypatch, streaming):
+    if not streaming:
+        monkeypatch.setattr(epe, "ijson", None)
+    path = tmp_path / "message_1.json"
+    write_page(path, {"participants": [{"name": "A"}], "title": "A"})
+
+    with pytest.raises(epe.UnexpectedLayout):
+        epe.scan_photos_from_file(str(path))
+    assert list(epe.extract_photos_from_page(str(path))) == full_parse(path) == []
+
+
+def test_pages_are_in_numeric_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(epe, "conversation_listings", {})
+    for name in ("message_10.json", "message_2.json", "message_1.json", "x.json"):
+        (tmp_path / name).write_text("{}")
+
+    pages = epe.list_conversation_files(str(tmp_path))
+
+    assert [p.rsplit("/", 1)[1] for p in pages] == [
+        "message_1.json",
+        "message_2.json",
+        "message_10.json",
+        "x.json",
+    ]
@@ -0,0 +1,25 @@
+"""
+Tests for `schedule_edits()`, which puts photos in the order they're on disk.
+"""
+import edit_photo_exif as epe
+
+
+def test_files_without_blocks_go_after_the_rest(monkeypatch):
+    locations = {
+        # No blocks mapped, so this is an inode number, not an offset.
+        "a/empty.jpg": (1, 1, 12),
+        "a/late.jpg": (1, 0, 900000),
+        "b/early.jpg": (1, 0, 4096),
+    }
+    monkeypatch.setattr(epe, "URI_ROOT", "")
+    monkeypatch.setattr(epe, "disk_location", lambda path: locations[path])
+    photos = epe.PhotoTable([epe.Photo(uri, 0) for uri in locations])
+
+    scheduled = epe.schedule_edits(photos)
+
+    assert [photo.uri for photo in scheduled] == [
+        "b/early.jpg",
+        "a/late.jpg",
+        "a/empty.jpg",
+    ]
+
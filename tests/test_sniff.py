@@ -0,0 +1,35 @@
+"""
+Tests for `sniff_media_type()`, which tells formats apart by their first bytes.
+"""
+import pytest
+
+import edit_photo_exif as epe
+
+
+def ftyp(brand: bytes) -> bytes:
+    return (24).to_bytes(4, "big") + b"ftyp" + brand + b"\0\0\0\0" + brand + b"mif1"
+
+
+@pytest.mark.parametrize(
+    "magic, media_type",
+    [
+        (b"\xff\xd8\xff\xe0", "jpeg"),
+        (epe.PNG_SIGNATURE, "png"),
+        (b"GIF89a", "gif"),
+        (b"RIFF\0\0\0\0WEBPVP8 ", "webp"),
+        (ftyp(b"heic"), "heic"),
+        (ftyp(b"qt  "), "mov"),
+        (ftyp(b"isom"), "mp4"),
+        (ftyp(b"mp42"), "mp4"),
+        (ftyp(b"3gp4"), "mp4"),
+        (ftyp(b"avif"), None),
+        (ftyp(b"avis"), None),
+        (b"hello", None),
+    ],
+)
+def test_sniff_media_type(tmp_path, monkeypatch, magic, media_type):
+    monkeypatch.setattr(epe, "media_types", {})
+    path = tmp_path / "file"
+    path.write_bytes(magic + b"\0" * 32)
+
+    assert epe.sniff_media_type(str(path)) == media_type